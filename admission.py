@@ -0,0 +1,66 @@
+import threading
+
+from flask import g, jsonify, request
+
+
+# ------------------- Admission Control -------------------
+#
+# Requests are sorted into route classes by endpoint and every class has its
+# own limit on concurrent requests. When a class is full a request waits up
+# to `wait` seconds for a slot and is then turned away with 503 and
+# Retry-After, so a slow database fills up the "db" slots and nothing else:
+# static pages and pages served from cache keep their own headroom. A limit
+# of 0 means no limit.
+
+
+class AdmissionControl:
+    def __init__(self, limits, routes, default="db", wait=0.05, retry_after=1):
+        # limits: {class: max concurrent}; routes: {endpoint: class}.
+        self.routes = dict(routes)
+        self.default = default
+        self.wait = wait
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._slots = {name: threading.BoundedSemaphore(limit) for name, limit in limits.items() if limit}
+        self._limits = dict(limits)
+        self._active = {name: 0 for name in limits}
+        self._shed = {name: 0 for name in limits}
+
+    def init_app(self, app):
+        app.before_request(self._before)
+        app.teardown_request(self._teardown)
+
+    def route_class(self, endpoint):
+        return self.routes.get(endpoint, self.default)
+
+    def _before(self):
+        name = self.route_class(request.endpoint)
+        slots = self._slots.get(name)
+        if slots is not None and not slots.acquire(timeout=self.wait):
+            with self._lock:
+                self._shed[name] = self._shed.get(name, 0) + 1
+            response = jsonify({"success": False, "message": "Server busy, please try again"})
+            response.headers["Retry-After"] = str(self.retry_after)
+            return response, 503
+        g.admission_class = name
+        with self._lock:
+            self._active[name] = self._active.get(name, 0) + 1
+
+    def _teardown(self, exc):
+        name = g.pop("admission_class", None)
+        if name is None:
+            return
+        with self._lock:
+            self._active[name] -= 1
+        slots = self._slots.get(name)
+        if slots is not None:
+            slots.release()
+
+    def stats(self):
+        with self._lock:
+            stats = {}
+            for name, limit in self._limits.items():
+                stats["%s_limit" % name] = limit
+                stats["%s_active" % name] = self._active.get(name, 0)
+                stats["%s_shed" % name] = self._shed.get(name, 0)
+            return stats
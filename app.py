@@ -1,13 +1,52 @@
-from flask import Flask, request, jsonify, send_from_directory,render_template, session, redirect
+from flask import Flask, request, jsonify, render_template, session, redirect, g, make_response
+from flask import Response
+from markupsafe import Markup, escape
+from flask import stream_with_context
 from functools import wraps
 import os
+import json
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from decimal import Decimal
 import mysql.connector
 from mysql.connector import Error
-from werkzeug.security import generate_password_hash, check_password_hash
 from dotenv import load_dotenv
+from db_pool import CircuitBreaker, ConnectionPool, DatabaseUnavailable, PoolTimeout, ReplicaSet
+from admission import AdmissionControl
+from catalog_cache import CatalogCache
+from metrics import RequestMetrics, add_phase_time, timed_phase
+from hashing import HashingBusy, PasswordHasher
+from static_cache import StaticCache
+from cart_store import CartStore
+from query_stats import QueryStats
+from user_cache import UserCache
+import inventory
+import order_events
+import order_export
+import product_import
+import sales
+from product_search import ProductIndex, to_price
+import json_provider
+from json_provider import FastJSONProvider
 
 load_dotenv()
-app = Flask(__name__, static_folder='.', static_url_path='')
+
+class TimedJSONProvider(FastJSONProvider):
+    # Counts JSON encoding towards the request's "serialize" phase.
+    def dumps(self, obj, **kwargs):
+        with timed_phase("serialize"):
+            return super().dumps(obj, **kwargs)
+
+    def dump_bytes(self, obj):
+        with timed_phase("serialize"):
+            return super().dump_bytes(obj)
+
+# Pages are served from static_pages below; serving the whole project
+# directory as static files would also expose app.py and .env.
+app = Flask(__name__, static_folder=None)
+app.json = TimedJSONProvider(app)
   # Replace with a secure random key
 app.secret_key = os.getenv("SECRET_KEY", "fallback-key")
   # Replace with a secure random key
@@ -24,77 +63,426 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "3"))
+# Server-side limits so a stuck query or lock wait gives its thread back.
+DB_QUERY_TIMEOUT_MS = int(os.getenv("DB_QUERY_TIMEOUT_MS", "5000"))
+DB_LOCK_WAIT_TIMEOUT = int(os.getenv("DB_LOCK_WAIT_TIMEOUT", "5"))
+
+def _connect_mysql(host=None, port=None):
+    conn = mysql.connector.connect(
+        host=host or os.getenv("DB_HOST"),
+        user=os.getenv("DB_USER"),
+        port=port or os.getenv("DB_PORT"),
+        password=os.getenv("DB_PASSWORD"),
+        database=os.getenv("DB_NAME"),
+        auth_plugin='mysql_native_password',
+        connection_timeout=DB_CONNECT_TIMEOUT,
+    )
+    cursor = conn.cursor()
+    try:
+        # max_execution_time applies to SELECTs, the lock wait to writes.
+        cursor.execute("SET SESSION max_execution_time = %s, SESSION innodb_lock_wait_timeout = %s",
+                       (DB_QUERY_TIMEOUT_MS, DB_LOCK_WAIT_TIMEOUT))
+    finally:
+        cursor.close()
+    return conn
+
+def _pool_options(prefix):
+    return dict(
+        size=int(os.getenv(prefix + "_SIZE", os.getenv("DB_POOL_SIZE", "5"))),
+        max_overflow=int(os.getenv(prefix + "_MAX_OVERFLOW", os.getenv("DB_POOL_MAX_OVERFLOW", "5"))),
+        max_lifetime=float(os.getenv("DB_POOL_MAX_LIFETIME", "1800")),
+        pre_ping=os.getenv("DB_POOL_PRE_PING", "1") not in ("0", "false", "False"),
+        acquire_timeout=float(os.getenv(prefix + "_TIMEOUT", os.getenv("DB_POOL_TIMEOUT", "5"))),
+    )
+
+def _observe_query(statement, seconds):
+    add_phase_time("db", seconds)
+
+# After DB_BREAKER_FAILURES failed connects in a row, requests fail fast
+# with 503 for DB_BREAKER_RESET_SECONDS instead of each waiting on the
+# connect timeout.
+db_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv("DB_BREAKER_FAILURES", "5")),
+    reset_timeout=float(os.getenv("DB_BREAKER_RESET_SECONDS", "10")),
+)
+db_pool = ConnectionPool(_connect_mysql, name="writer", breaker=db_breaker, **_pool_options("DB_POOL"))
+db_pool.query_observer = _observe_query
+
+def _read_pool(address):
+    # "host" or "host:port"; user, password and database are the writer's.
+    host, _, port = address.strip().partition(":")
+    pool = ConnectionPool(lambda: _connect_mysql(host, port or None), read_only=True,
+                          name=address.strip(), **_pool_options("DB_READ_POOL"))
+    pool.query_observer = _observe_query
+    return pool
+
+# DB_READ_HOSTS=replica1:3306,replica2:3306 sends GET requests to the
+# replicas; with it unset every request uses the writer as before.
+read_replicas = ReplicaSet(
+    [_read_pool(address) for address in os.getenv("DB_READ_HOSTS", "").split(",") if address.strip()],
+    retry_after=float(os.getenv("DB_READ_RETRY_SECONDS", "30")),
+)
+# After a user's own write their reads stay on the writer this long, so
+# they never see a replica that has not caught up with it yet.
+READ_YOUR_WRITES_SECONDS = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "5"))
+
+request_metrics = RequestMetrics()
+request_metrics.init_app(app)
+
+# Route classes for admission control. "static" and "cached" never wait on
+# the database while the catalog is cached, so they keep serving when the
+# "db" and "heavy" slots are full of requests stuck on a slow server. "auth"
+# routes spend most of their time hashing, which PasswordHasher already
+# admits on its own.
+ROUTE_CLASSES = {
+    None: "static",
+    "index": "static", "demo": "static", "demo_page": "static", "thank_page": "static",
+    "order_info": "static", "your_orders_page": "static", "cart_page": "static",
+    "edit_profile12": "static", "edit_profile1": "static", "edit_profile": "static",
+    "edit_profile_user": "static", "edit_profile_user_page": "static", "items_page": "static",
+    "logout": "static", "metrics": "static", "db_pool_stats": "static", "admin_query_stats": "static",
+    "product_page": "cached", "get_products": "cached", "search_products": "cached",
+    "login": "auth", "register": "auth", "owner_login": "auth", "owner_update_password": "auth",
+    "update_profile": "auth",
+    "get_all_orders": "heavy", "get_users": "heavy", "import_products": "heavy",
+    "sales_report": "heavy", "update_order_status_bulk": "heavy", "export_orders": "heavy",
+    # Streams are capped by order_stream_slots.
+    "order_events_stream": "stream", "order_events_poll": "stream",
+}
+# Threads per worker process (serve.py). No class defaults to fewer slots
+# than this, so a healthy app never sheds a request just because all its
+# threads are busy: gthread queues those. Lower ADMISSION_DB to keep threads
+# free for static and cached pages while the database is slow. A request
+# waits for a slot as long as it would wait for a pooled connection.
+# Owner dashboard streams hold at most ORDER_EVENTS_MAX_STREAMS of these
+# threads (default a quarter); dashboards past that cap short-poll
+# /order-events/poll instead. Raise both together.
+WEB_THREADS = int(os.getenv("WEB_THREADS", "8"))
+admission = AdmissionControl(
+    {
+        "static": int(os.getenv("ADMISSION_STATIC", "0")),
+        "cached": int(os.getenv("ADMISSION_CACHED", "0")),
+        "auth": int(os.getenv("ADMISSION_AUTH", "0")),
+        "db": int(os.getenv("ADMISSION_DB", WEB_THREADS)),
+        "heavy": int(os.getenv("ADMISSION_HEAVY", max(1, WEB_THREADS // 2))),
+        "stream": 0,
+    },
+    ROUTE_CLASSES,
+    wait=float(os.getenv("ADMISSION_WAIT", os.getenv("DB_POOL_TIMEOUT", "5"))),
+)
+admission.init_app(app)
+request_metrics.add_gauges("admission", admission.stats)
+request_metrics.add_gauges("db_breaker", db_breaker.stats)
+request_metrics.add_gauges("db_pool", db_pool.stats)
+if read_replicas:
+    request_metrics.add_gauges("db_read_pool", read_replicas.stats)
+
+password_hasher = PasswordHasher(
+    method=os.getenv("PASSWORD_HASH_METHOD", "pbkdf2:sha256:600000"),
+    salt_length=int(os.getenv("PASSWORD_SALT_LENGTH", "16")),
+    workers=int(os.getenv("HASH_WORKERS", "2")),
+    max_pending=int(os.getenv("HASH_MAX_PENDING", "32")),
+    admission_timeout=float(os.getenv("HASH_ADMISSION_TIMEOUT", "1")),
+)
+request_metrics.add_gauges("password_hash", password_hasher.stats)
+
+static_pages = StaticCache(
+    app.root_path,
+    ["index.html", "Thank.html", "order_info.html", "your_orders.html", "cart.html", "products.html",
+     "insert.html", "edit_profile.html", "edit_profile_user.html", "items.html"],
+    max_age=int(os.getenv("STATIC_MAX_AGE", "0")),
+    check_interval=float(os.getenv("STATIC_CHECK_INTERVAL", "2")),
+)
+static_pages.load_all()
+
+def serve_page(name):
+    return static_pages.response(name, app.response_class)
+
+def reads_from_replica():
+    if not read_replicas or request.method not in ("GET", "HEAD"):
+        return False
+    wrote_at = session.get("wrote_at")
+    return wrote_at is None or time.time() - wrote_at > READ_YOUR_WRITES_SECONDS
+
+@app.after_request
+def remember_write(response):
+    if read_replicas and request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        session["wrote_at"] = time.time()
+    return response
+
 def get_db_connection():
+    # Pooled connection; conn.close() hands it back to the pool. Anything a
+    # route forgets to close is returned in release_db_connections().
+    # GET requests read from a replica when there is a healthy one. Never
+    # returns None: when there is no connection to be had it raises
+    # DatabaseUnavailable, which becomes a 503 with Retry-After.
+    started = time.perf_counter()
     try:
-        return mysql.connector.connect(
-            host=os.getenv("DB_HOST"),
-            user=os.getenv("DB_USER"),
-            port=os.getenv("DB_PORT"),
-            password=os.getenv("DB_PASSWORD"),
-            database=os.getenv("DB_NAME"),
-            auth_plugin='mysql_native_password'
-        )
-    except Error as e:
+        conn = read_replicas.acquire() if reads_from_replica() else None
+        if conn is None:
+            conn = db_pool.acquire()
+    except (Error, PoolTimeout) as e:
+        print("Error connecting to MySQL:", e)
+        raise DatabaseUnavailable(str(e), retry_after=1)
+    finally:
+        add_phase_time("db", time.perf_counter() - started)
+    g.setdefault("db_connections", []).append(conn)
+    return conn
+
+def get_background_connection():
+    # For threads that run outside a request (pollers, warm-up), and for
+    # the cart store, which reports a failed connection itself.
+    try:
+        return db_pool.acquire()
+    except (Error, PoolTimeout, DatabaseUnavailable) as e:
         print("Error connecting to MySQL:", e)
         return None
 
+# Per-statement latency, slow query log and EXPLAIN capture for every
+# pooled cursor; QUERY_STATS=0 turns it off.
+query_stats = QueryStats(
+    get_background_connection,
+    slow_threshold=float(os.getenv("QUERY_SLOW_SECONDS", "0.5")),
+    explain_interval=float(os.getenv("QUERY_EXPLAIN_INTERVAL", "300")),
+    dump_path=os.getenv("QUERY_STATS_DUMP") or None,
+    dump_interval=float(os.getenv("QUERY_STATS_DUMP_INTERVAL", "60")),
+)
+if os.getenv("QUERY_STATS", "1") != "0":
+    for pool in [db_pool] + read_replicas.pools:
+        pool.statement_observer = query_stats.record
+request_metrics.add_gauges("query_stats", query_stats.totals)
+
+catalog_cache = CatalogCache()
+product_index = ProductIndex()
+
+order_feed = order_events.OrderEventFeed(
+    get_background_connection,
+    buffer_size=int(os.getenv("ORDER_EVENTS_BUFFER", "1000")),
+    poll_interval=float(os.getenv("ORDER_EVENTS_POLL_INTERVAL", "1")),
+    retention_hours=int(os.getenv("ORDER_EVENTS_RETENTION_HOURS", "24")),
+)
+
+# CART_STORE=0 turns the in-memory carts off: every cart read and write
+# goes straight to the cart table.
+cart_store = CartStore(
+    get_background_connection,
+    max_users=int(os.getenv("CART_STORE_MAX_USERS", "10000")) if os.getenv("CART_STORE", "1") != "0" else 0,
+    ttl=float(os.getenv("CART_STORE_TTL", "5")),
+)
+request_metrics.add_gauges("cart_store", cart_store.stats)
+request_metrics.add_gauges("product_index", lambda: {
+    key: value for key, value in product_index.stats().items() if key != "version"
+})
+
+# Profile and order history per user (see user_cache.py); USER_CACHE=0
+# turns it off.
+user_cache = UserCache(
+    max_users=int(os.getenv("USER_CACHE_MAX_USERS", "10000")) if os.getenv("USER_CACHE", "1") != "0" else 0,
+    ttl=float(os.getenv("USER_CACHE_TTL", "30")),
+)
+request_metrics.add_gauges("user_cache", user_cache.stats)
+
+def user_data_changed(user_id):
+    # After a committed write to the user's own profile or orders. The
+    # session stamp makes every process skip what it cached before now.
+    user_cache.invalidate(user_id)
+    if session.get("user_id") == user_id:
+        session["user_cache_stamp"] = time.time()
+
+def cached_for_user(user_id, kind, load):
+    return user_cache.get(user_id, kind, load, newer_than=session.get("user_cache_stamp"))
+
+@app.teardown_appcontext
+def release_db_connections(exc):
+    for conn in g.pop("db_connections", []):
+        conn.close()
+
+def stream_db_connection(response, conn):
+    # `conn` feeds a streamed, unbuffered response, so the response owns it
+    # instead of the request: teardown can run before the body is ever
+    # read (stream_with_context closes the context when a client leaves
+    # before the first chunk), and close() would then drain the result.
+    # The body returns it once read through; otherwise it is discarded
+    # when the server closes the response (a no-op if already returned).
+    g.db_connections.remove(conn)
+    response.call_on_close(conn.discard)
+    return response
+
 def hash_password(password):
-    return generate_password_hash(password)
+    with timed_phase("hash"):
+        return password_hasher.hash(password)
 
 def verify_password(stored_hash, password):
-    return check_password_hash(stored_hash, password)
+    with timed_phase("hash"):
+        return password_hasher.verify(stored_hash, password)
+
+def rehash_if_needed(table, row_id, stored_hash, password):
+    # Called after a successful login: upgrade hashes made with older
+    # PASSWORD_HASH_METHOD settings. Failing here must not fail the login.
+    if not password_hasher.needs_rehash(stored_hash):
+        return
+    try:
+        new_hash = hash_password(password)
+        conn = get_db_connection()
+        with conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE %s SET password = %%s WHERE id = %%s AND password = %%s" % table,
+                           (new_hash, row_id, stored_hash))
+            conn.commit()
+            cursor.close()
+    except Exception as e:
+        print("Error rehashing password:", e)
+
+@app.errorhandler(HashingBusy)
+def hashing_busy(e):
+    response = jsonify({"success": False, "message": "Server busy, please try again"})
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
+@app.errorhandler(DatabaseUnavailable)
+def database_unavailable(e):
+    response = jsonify({"success": False, "message": "Database unavailable, please try again"})
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response, 503
+
+def insert_rows(cursor, table, columns, rows, update=()):
+    # One multi-row INSERT instead of a round trip per row. Rows hitting a
+    # unique key overwrite the `update` columns instead.
+    placeholders = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    query = "INSERT INTO %s (%s) VALUES %s" % (table, ", ".join(columns), ", ".join([placeholders] * len(rows)))
+    if update:
+        query += " ON DUPLICATE KEY UPDATE " + ", ".join("%s = VALUES(%s)" % (column, column) for column in update)
+    cursor.execute(query, [value for row in rows for value in row])
+
+# A streamed SELECT runs for as long as the client takes to read it, so it
+# gets its own limit instead of DB_QUERY_TIMEOUT_MS.
+STREAM_QUERY_TIMEOUT_MS = int(os.getenv("STREAM_QUERY_TIMEOUT_MS", "3600000"))
+
+def streamed_select(statement):
+    return statement.replace("SELECT", "SELECT /*+ MAX_EXECUTION_TIME(%d) */" % STREAM_QUERY_TIMEOUT_MS, 1)
+
+def stream_json_list(key, conn, cursor):
+    # {"success": true, key: [...]} sent while the rows are still being
+    # read: the executed, unbuffered cursor is drained in batches and never
+    # held in memory as a whole. The status line is long gone by the time a
+    # fetch can fail, so the error is raised on: the server drops the
+    # connection and the client sees a broken body, not a short list.
+    def rows():
+        finished = False
+        try:
+            while True:
+                batch = cursor.fetchmany(json_provider.STREAM_BATCH)
+                if not batch:
+                    break
+                yield from batch
+            finished = True
+        except Exception:
+            app.logger.exception("Error streaming %s", key)
+            raise
+        finally:
+            if finished:
+                cursor.close()
+                conn.close()
+            else:
+                # Part-read (see export_orders): drop it, don't drain it.
+                conn.discard()
+
+    body = app.json.json_array({"success": True}, key, rows())
+    return stream_db_connection(app.response_class(stream_with_context(body), mimetype=app.json.mimetype), conn)
+
+def conditional_response(etag, build):
+    # 304 without building the body when the client already has `etag`.
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = make_response(build())
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+# Changes whenever the app (and so templates/demo.html) is redeployed.
+_DEPLOY_STAMP = "%x" % int(os.path.getmtime(os.path.join(app.root_path, "templates", "demo.html")))
+
+# Rendered into the cached product page where the per-user greeting goes.
+USER_SLOT = "<!--user-slot-->"
+
+def current_catalog():
+    # (version, products); while the database is unreachable, the copy this
+    # process already has, so catalog pages stay up during an outage.
+    try:
+        conn = get_db_connection()
+        with conn:
+            return catalog_cache.get_products(conn)
+    except (DatabaseUnavailable, Error):
+        cached = catalog_cache.last()
+        if cached is None:
+            raise
+        return cached
+
+def render_product_page(products):
+    # Rendered once per catalog version, split around the per-user slot so a
+    # request only has to join three strings.
+    html = render_template('demo.html', products=products, user_slot=Markup(USER_SLOT))
+    head, _, tail = html.partition(USER_SLOT)
+    return head, tail
+
+def product_page_parts(version, products):
+    return catalog_cache.derived(version, "products.html", lambda: render_product_page(products))
+
+def products_json(version, products):
+    # Serialised once per catalog version, newest first.
+    return catalog_cache.derived(version, "get-products.json", lambda: app.json.dumps(
+        {"success": True, "products": products[::-1]}
+    ) + "\n")
+
 @app.route('/products')
 def product_page():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM products")
-    products = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    return render_template('demo.html', products=products) 
+    version, products = current_catalog()
+
+    user_name = session.get("user_name")
+    greeting = str(escape("Hi, %s!" % user_name)) if user_name else ""
+    etag = "products-html-%s-%s-%x" % (version, _DEPLOY_STAMP, zlib.crc32(greeting.encode()))
+
+    def build():
+        head, tail = product_page_parts(version, products)
+        return head + greeting + tail
+
+    return conditional_response(etag, build)
 # ------------------- Static Routes -------------------
 @app.route("/get_cart", methods=["GET"])
 @login_required
 def get_cart():
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({"success": False, "message": "Database connection error"}), 500
-
-    cursor = conn.cursor(dictionary=True)
     try:
-        cursor.execute("SELECT * FROM cart")
-        return jsonify({"success": True, "cart": cursor.fetchall()})
+        return jsonify({"success": True, "cart": cart_store.lines(session["user_id"])})
     except Exception as e:
         print("Error fetching cart:", e)
         return jsonify({"success": False, "message": "Failed to load cart"}), 500
-    finally:
-        cursor.close()
-        conn.close()
 
 @app.route("/remove_cart_item", methods=["POST"])
 @login_required
 def remove_cart_item():
-    data = request.get_json()
+    # A cart line is named by its pickle_name, or by the id /get_cart gave it.
+    data = request.get_json(silent=True) or {}
+    pickle_name = data.get("pickle_name")
     item_id = data.get("id")
 
-    if not item_id:
+    if not pickle_name and not item_id:
         return jsonify({"success": False, "message": "Invalid item ID"}), 400
+    if not pickle_name:
+        # Matched against the int ids in the cart, so "6" must become 6.
+        try:
+            item_id = int(item_id)
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "message": "Invalid item ID"}), 400
 
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({"success": False, "message": "Database connection error"}), 500
-
-    cursor = conn.cursor()
     try:
-        cursor.execute("DELETE FROM cart WHERE id = %s", (item_id,))
-        conn.commit()
+        if not cart_store.remove(session["user_id"], pickle_name=pickle_name, row_id=item_id):
+            return jsonify({"success": False, "message": "Item not in cart"}), 404
         return jsonify({"success": True})
     except Exception as e:
         print("Error removing cart item:", e)
         return jsonify({"success": False, "message": "Database error"}), 500
-    finally:
-        cursor.close()
-        conn.close()
 
 @app.route('/place_order_from_cart', methods=['POST'])
 @login_required
@@ -105,37 +493,60 @@ def place_order_from_cart():
         return jsonify({'success': False, 'message': 'Not logged in'}), 401
 
     conn = get_db_connection()
-    if not conn:
-        return jsonify({'success': False, 'message': 'Database connection error'}), 500
 
-    cursor = conn.cursor(dictionary=True)
+    cursor = conn.cursor()
     try:
-        # Get all cart items for the user
-        cursor.execute("SELECT * FROM cart WHERE user_id = %s", (user_id,))
-        cart_items = cursor.fetchall()
+        conn.start_transaction()
 
-        if not cart_items:
+        # Lock the user's cart lines and pin the set being checked out, so a
+        # concurrent add_to_cart is neither ordered twice nor deleted unseen.
+        cursor.execute("SELECT MAX(id) FROM cart WHERE user_id = %s FOR UPDATE", (user_id,))
+        last_id = cursor.fetchone()[0]
+
+        if last_id is None:
+            conn.rollback()
             return jsonify({'success': False, 'message': 'Cart is empty'}), 400
 
-        # Process each cart item into individual orders
-        for item in cart_items:
-            cursor.execute("""
-                INSERT INTO orders (user_id, pickles, quantity, cost, status)
-                VALUES (%s, %s, %s, %s, 'Ordered')
-            """, (
-                user_id,
-                item["pickle_name"],
-                item["quantity"],
-                item["cost"]
-            ))
+        cursor.execute("""
+            SELECT pickle_name, COUNT(*), SUM(quantity), SUM(cost)
+            FROM cart
+            WHERE user_id = %s AND id <= %s
+            GROUP BY pickle_name
+        """, (user_id, last_id))
+        totals = cursor.fetchall()
+
+        # Move the cart into orders server-side, whatever its size
+        cursor.execute("""
+            INSERT INTO orders (user_id, pickles, quantity, cost, status)
+            SELECT user_id, pickle_name, quantity, cost, 'Ordered'
+            FROM cart
+            WHERE user_id = %s AND id <= %s
+            ORDER BY id
+        """, (user_id, last_id))
+        count = cursor.rowcount
+        day = sales.order_day(cursor, cursor.lastrowid)
+        order_events.record(cursor, "order-created", user_id=user_id, count=count)
 
         # Clear the cart
-        cursor.execute("DELETE FROM cart WHERE user_id = %s", (user_id,))
+        cursor.execute("DELETE FROM cart WHERE user_id = %s AND id <= %s", (user_id, last_id))
+
+        # Rows every checkout of a popular pickle touches go last, so their
+        # locks are held only until the commit right after.
+        sales.add(cursor, [(day, pickle, 'Ordered') + tuple(counts) for pickle, *counts in totals])
+        inventory.take(cursor, [(pickle, quantity) for pickle, _, quantity, _ in totals])
         conn.commit()
+        cart_store.invalidate(user_id)
+        user_data_changed(user_id)
+        order_feed.poke()
 
         return jsonify({'success': True, 'redirect': '/Thank.html'})
 
+    except inventory.OutOfStock as e:
+        conn.rollback()
+        return jsonify({'success': False, 'message': str(e), 'pickle': e.pickle}), 409
+
     except Exception as e:
+        conn.rollback()
         print("Error in /place_order_from_cart:", e)
         return jsonify({'success': False, 'message': 'Database error'}), 500
 
@@ -148,7 +559,7 @@ def place_order_from_cart():
 @app.route("/")
 @app.route("/index.html")
 def index():
-    return send_from_directory(os.getcwd(), "index.html")
+    return serve_page("index.html")
 
 @app.route("/demo.html")
 @login_required
@@ -158,30 +569,37 @@ def demo():
 @app.route("/Thank.html")
 @login_required
 def thank_page():
-    return send_from_directory(os.getcwd(), "Thank.html")
+    return serve_page("Thank.html")
 
 @app.route("/order_info.html")
 def order_info():
-    return send_from_directory(os.getcwd(), "order_info.html")
+    return serve_page("order_info.html")
 
 @app.route("/your_orders.html")
 @login_required
 def your_orders_page():
-    return send_from_directory(os.getcwd(), "your_orders.html")
+    return serve_page("your_orders.html")
 
 @app.route("/cart.html")
 @login_required
 def cart_page():
-    return send_from_directory(os.getcwd(), "cart.html")
+    return serve_page("cart.html")
 @app.route("/products.html")
 def edit_profile12():
-    return send_from_directory(os.getcwd(), "products.html")
+    return serve_page("products.html")
 @app.route("/insert.html")
 def edit_profile1():
-    return send_from_directory(os.getcwd(), "insert.html")
+    return serve_page("insert.html")
 @app.route("/edit_profile.html")
 def edit_profile():
-    return send_from_directory(os.getcwd(), "edit_profile.html")
+    return serve_page("edit_profile.html")
+@app.route("/edit_profile_user.html")
+@login_required
+def edit_profile_user_page():
+    return serve_page("edit_profile_user.html")
+@app.route("/items.html")
+def items_page():
+    return serve_page("items.html")
 @app.route("/insert-product", methods=["POST"])
 def insert_product():
     data = request.get_json()
@@ -191,13 +609,23 @@ def insert_product():
 
     if not all([name, image_url, price]):
         return jsonify({"success": False, "message": "All fields are required."})
+    # Optional; left out, the product is not stock-tracked.
+    try:
+        stock = parse_stock(data.get("stock"))
+    except ValueError:
+        return jsonify({"success": False, "message": "stock must be a whole number of at least 0"}), 400
 
+    connection = get_db_connection()
+    cursor = connection.cursor()
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor()
-        query = "INSERT INTO products (name, image_url, price) VALUES (%s, %s, %s)"
-        cursor.execute(query, (name, image_url, price))
+        catalog_cache.bump_version(cursor)
+        query = "INSERT INTO products (name, image_url, price, stock) VALUES (%s, %s, %s, %s)"
+        cursor.execute(query, (name, image_url, price, stock))
         connection.commit()
+        try:
+            product_index.add({"id": cursor.lastrowid, "name": name, "image_url": image_url, "price": to_price(price)})
+        except ValueError:
+            pass  # picked up from the catalog on the next search
 
         return jsonify({"success": True})
     except Error as e:
@@ -206,16 +634,123 @@ def insert_product():
         if connection.is_connected():
             cursor.close()
             connection.close()
+
+def parse_stock(value):
+    # None or "" for "not tracked", else a count of at least 0.
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool) or isinstance(value, float) and not value.is_integer():
+        raise ValueError(value)
+    stock = int(value)
+    if stock < 0:
+        raise ValueError(value)
+    return stock
+
+@app.route("/update-stock", methods=["POST"])
+def update_stock():
+    # {"id": 1, "stock": 25} sets the count, {"id": 1, "add": 10} adds to it
+    # (a delivery) without overwriting units sold meanwhile. "stock": null
+    # stops tracking. Stock is not part of the cached catalog, so this does
+    # not bump the catalog version.
+    data = request.get_json() or {}
+    product_id = data.get("id")
+    if not product_id:
+        return jsonify({"success": False, "message": "Product ID is required"}), 400
+    try:
+        if "add" in data:
+            added = int(data["add"])
+            query = "UPDATE products SET stock = stock + %s WHERE id = %s AND stock IS NOT NULL AND stock >= %s"
+            params = (added, product_id, max(0, -added))
+        else:
+            query, params = "UPDATE products SET stock = %s WHERE id = %s", (parse_stock(data.get("stock")), product_id)
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "stock must be a whole number of at least 0"}), 400
+
+    conn = get_db_connection()
+    with conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(query, params)
+            updated = cursor.rowcount
+            cursor.execute("SELECT stock FROM products WHERE id = %s", (product_id,))
+            row = cursor.fetchone()
+            conn.commit()
+        except Error as e:
+            conn.rollback()
+            print("Error updating stock:", e)
+            return jsonify({"success": False, "message": "Database error"}), 500
+        finally:
+            cursor.close()
+    if row is None:
+        return jsonify({"success": False, "message": "Product not found"}), 404
+    if "add" in data and not updated:
+        return jsonify({"success": False, "message": "Product is not stock-tracked or has too little stock", "stock": row[0]}), 409
+    return jsonify({"success": True, "stock": row[0]})
+
+IMPORT_CHUNK_SIZE = 500
+
+@app.route("/import-products", methods=["POST"])
+def import_products():
+    # Streaming bulk import: CSV (name,image_url,price) or JSON lines. Rows
+    # are parsed as they arrive and inserted IMPORT_CHUNK_SIZE at a time,
+    # one transaction per chunk. A name already in the catalog updates that
+    # product's image and price.
+    conn = get_db_connection()
+
+    report = {"inserted": 0, "rejected": 0, "errors": []}
+    records = product_import.iter_records(request.stream, request.content_type)
+    with conn:
+        cursor = conn.cursor()
+        try:
+            for chunk in product_import.chunked_rows(records, IMPORT_CHUNK_SIZE, report):
+                catalog_cache.bump_version(cursor)
+                insert_rows(cursor, "products", product_import.COLUMNS, chunk, update=("image_url", "price"))
+                conn.commit()
+                report["inserted"] += len(chunk)
+        except (Error, UnicodeDecodeError) as e:
+            conn.rollback()
+            print("Error importing products:", e)
+            return jsonify({"success": False, "message": str(e), **report}), 500
+        finally:
+            cursor.close()
+
+    return jsonify({"success": True, **report})
+
 @app.route('/get-products', methods=['GET'])
 def get_products():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM products ORDER BY id DESC")
-    products = cursor.fetchall()
-    cursor.close()
-    conn.close()
+    version, products = current_catalog()
+
+    def build():
+        return app.response_class(products_json(version, products), mimetype="application/json")
+
+    return conditional_response("products-json-%s" % version, build)
+
+SEARCH_LIMIT_DEFAULT = 20
+SEARCH_LIMIT_MAX = 100
+
+@app.route('/search-products', methods=['GET'])
+def search_products():
+    # ?q=&min_price=&max_price=&sort=relevance|price_asc|price_desc&limit=&offset=
+    # answered from the in-process ProductIndex (see product_search.py).
+    query = request.args.get("q", "")
+    sort = request.args.get("sort", "relevance")
+    if sort not in ProductIndex.SORTS:
+        return jsonify({"success": False, "message": "sort must be one of " + ", ".join(ProductIndex.SORTS)}), 400
+    try:
+        min_price = to_price(request.args["min_price"]) if request.args.get("min_price") else None
+        max_price = to_price(request.args["max_price"]) if request.args.get("max_price") else None
+        limit = min(int(request.args.get("limit", SEARCH_LIMIT_DEFAULT)), SEARCH_LIMIT_MAX)
+        offset = int(request.args.get("offset", 0))
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid filter"}), 400
+    if limit < 1 or offset < 0:
+        return jsonify({"success": False, "message": "Invalid filter"}), 400
+
+    version, products = current_catalog()
+    product_index.sync(version, products)
 
-    return jsonify({"success": True, "products": products})
+    total, page = product_index.search(query, min_price, max_price, sort, limit, offset)
+    return jsonify({"success": True, "total": total, "products": page})
 
 # --- Delete Product ---
 @app.route('/delete-product', methods=['POST'])
@@ -228,10 +763,15 @@ def delete_product():
 
     conn = get_db_connection()
     cursor = conn.cursor()
+    catalog_cache.bump_version(cursor)
     cursor.execute("DELETE FROM products WHERE id = %s", (product_id,))
     conn.commit()
     cursor.close()
     conn.close()
+    try:
+        product_index.remove(int(product_id))
+    except (TypeError, ValueError):
+        pass
 
     return jsonify({"success": True})
 # ------------------- Auth APIs -------------------
@@ -245,11 +785,11 @@ def edit_profile_user():
         # Update database...
         return redirect('/some_page')
 
-    return send_from_directory(os.getcwd(),'edit_profile_user.html')
+    return serve_page('edit_profile_user.html')
 @app.route('/demo')
 @login_required
 def demo_page():
-    return send_from_directory(os.getcwd(), 'demo.html')
+    return serve_page('demo.html')
 
 # ------------------- Cart APIs -------------------
 
@@ -257,22 +797,13 @@ def demo_page():
 @login_required
 def add_to_cart_test():
     user_id = session.get("user_id")
-    conn = get_db_connection()
-    cursor = conn.cursor()
     try:
-        cursor.execute(
-            "INSERT INTO cart (user_id, pickles, quantity, cost) VALUES (%s, %s, %s, %s)",
-            (user_id, "Test Pickle", 1, 100)
-        )
-        conn.commit()
+        cart_store.add(user_id, [("Test Pickle", 1, Decimal(100))])
         return jsonify({"success": True})
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({"success": False, "message": "DB error"}), 500
-    finally:
-        cursor.close()
-        conn.close()
 @app.route("/add_to_cart", methods=["POST"])
 @login_required
 def add_to_cart():
@@ -283,10 +814,8 @@ def add_to_cart():
     if not user_id:
         return jsonify({"success": False, "message": "Not logged in"}), 401
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
     try:
+        rows = []
         for item in items:
             pickle_name = item.get("pickle_name")
             quantity = item.get("quantity")
@@ -294,19 +823,21 @@ def add_to_cart():
 
             if not pickle_name or not quantity or not cost:
                 continue  # skip invalid
-
-            cursor.execute(
-                "INSERT INTO cart (user_id, pickle_name, quantity, cost) VALUES (%s, %s, %s, %s)",
-                (user_id, pickle_name, quantity, cost)
-            )
-        conn.commit()
+            try:
+                quantity, cost = int(quantity), Decimal(str(cost))
+            except (TypeError, ValueError, ArithmeticError):
+                continue
+            if quantity < 1:
+                # Would shrink the line the cart merges it into.
+                return jsonify({"success": False, "message": "Invalid item"}), 400
+            rows.append((pickle_name, quantity, cost))
+
+        if rows:
+            cart_store.add(user_id, rows)
         return jsonify({"success": True})
     except Exception as e:
         print("Error adding to cart:", e)
         return jsonify({"success": False, "message": str(e)})
-    finally:
-        cursor.close()
-        conn.close()
 
 @app.route("/login", methods=["POST"])
 
@@ -316,8 +847,6 @@ def login():
     password = data.get("password")
 
     conn = get_db_connection()
-    if not conn:
-        return jsonify({"success": False, "message": "Database connection error"}), 500
 
     cursor = conn.cursor(dictionary=True)
     cursor.execute("SELECT * FROM users WHERE email = %s", (email,))
@@ -326,8 +855,10 @@ def login():
     conn.close()
 
     if user and verify_password(user["password"], password):
+        rehash_if_needed("users", user["id"], user["password"], password)
         session.permanent = True
         session["user_id"] = user["id"]
+        session["user_name"] = user["name"]
         return jsonify({"success": True})
     return jsonify({"success": False, "message": "Invalid credentials"})
 
@@ -344,8 +875,6 @@ def register():
     password = data.get("password")
 
     conn = get_db_connection()
-    if not conn:
-        return jsonify({"success": False, "message": "Database connection error"}), 500
 
     cursor = conn.cursor(dictionary=True)
     cursor.execute("SELECT * FROM users WHERE email = %s", (email,))
@@ -381,26 +910,37 @@ def buy_now():
     if not items:
         return jsonify({'success': False, 'message': 'No items received'}), 400
 
+    try:
+        rows = [
+            (user_id, item["pickle_name"], int(item["quantity"]), Decimal(str(item["cost"])), 'Ordered')
+            for item in items
+        ]
+    except (KeyError, TypeError, ValueError, ArithmeticError):
+        return jsonify({'success': False, 'message': 'Invalid item'}), 400
+    if any(quantity < 1 for _, _, quantity, _, _ in rows):
+        return jsonify({'success': False, 'message': 'Invalid item'}), 400
+
     conn = get_db_connection()
-    if not conn:
-        return jsonify({'success': False, 'message': 'Database connection error'}), 500
 
     cursor = conn.cursor()
     try:
-        for item in items:
-            cursor.execute("""
-                INSERT INTO orders (user_id, pickles, quantity, cost, status)
-                VALUES (%s, %s, %s, %s, 'Ordered')
-            """, (
-                user_id,
-                item["pickle_name"],
-                item["quantity"],
-                item["cost"]
-            ))
+        conn.start_transaction()
+        insert_rows(cursor, "orders", ("user_id", "pickles", "quantity", "cost", "status"), rows)
+        day = sales.order_day(cursor, cursor.lastrowid)
+        order_events.record(cursor, "order-created", user_id=user_id, count=len(rows))
+        sales.add(cursor, [(day, pickle, status, 1, quantity, cost) for _, pickle, quantity, cost, status in rows])
+        inventory.take(cursor, [(pickle, quantity) for _, pickle, quantity, _, _ in rows])
         conn.commit()
+        user_data_changed(user_id)
+        order_feed.poke()
         return jsonify({'success': True})
 
+    except inventory.OutOfStock as e:
+        conn.rollback()
+        return jsonify({'success': False, 'message': str(e), 'pickle': e.pickle}), 409
+
     except Exception as e:
+        conn.rollback()
         print("Error in /buy_now:", e)
         return jsonify({'success': False, 'message': str(e)}), 500
 
@@ -417,8 +957,6 @@ def owner_login():
     password = data.get("password")
 
     conn = get_db_connection()
-    if not conn:
-        return jsonify({"success": False, "message": "Database connection error"}), 500
 
     cursor = conn.cursor(dictionary=True)
     cursor.execute("SELECT * FROM owners WHERE email = %s", (email,))
@@ -427,6 +965,7 @@ def owner_login():
     conn.close()
 
     if owner and verify_password(owner["password"], password):
+        rehash_if_needed("owners", owner["id"], owner["password"], password)
         return jsonify({"success": True})
     return jsonify({"success": False, "message": "Invalid credentials"})
 
@@ -438,8 +977,6 @@ def owner_update_password():
     new_password = data.get("newPassword")
 
     conn = get_db_connection()
-    if not conn:
-        return jsonify({"success": False, "message": "Database connection error"}), 500
 
     cursor = conn.cursor(dictionary=True)
     cursor.execute("SELECT * FROM owners WHERE email = %s", (email,))
@@ -467,32 +1004,178 @@ def owner_update_password():
 @app.route("/get-orders", methods=["GET"])
 def get_all_orders():
     conn = get_db_connection()
-    if not conn:
-        return jsonify({"success": False, "message": "Database connection error"}), 500
 
     cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM orders ORDER BY id DESC")
-    orders = cursor.fetchall()
-    cursor.close()
-    conn.close()
+    cursor.execute(streamed_select("SELECT * FROM orders ORDER BY id DESC"))
+    return stream_json_list("orders", conn, cursor)
 
-    return jsonify({"success": True, "orders": orders})
+ORDERS_PAGE_DEFAULT = 50
+ORDERS_PAGE_MAX = 200
+ORDER_COLUMNS = "o.id, o.user_id, o.pickles, o.quantity, o.cost, o.status, o.created_at"
+
+def include_archived():
+    # Completed orders move to orders_archive (see archive.py); read paths
+    # only look there when the client asks for full history.
+    return request.args.get("include_archived") in ("1", "true")
+
+def parse_date_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    return datetime.strptime(value, "%Y-%m-%d")
+
+@app.route("/get-orders-page", methods=["GET"])
+def get_orders_page():
+    # Owner dashboard feed: newest first, keyset-paginated on orders.id so
+    # every page is an index range scan no matter how deep the client goes.
+    try:
+        limit = min(int(request.args.get("limit", ORDERS_PAGE_DEFAULT)), ORDERS_PAGE_MAX)
+        before = request.args.get("before", type=int)
+        after = request.args.get("after", type=int)
+        user_id = request.args.get("user_id", type=int)
+        date_from = parse_date_arg("from")
+        date_to = parse_date_arg("to")
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid filter"}), 400
+    if limit < 1:
+        return jsonify({"success": False, "message": "Invalid filter"}), 400
+    status = request.args.get("status")
+
+    where, params = [], []
+    if before is not None:
+        where.append("o.id < %s")
+        params.append(before)
+    if after is not None:
+        where.append("o.id > %s")
+        params.append(after)
+    if status:
+        where.append("o.status = %s")
+        params.append(status)
+    if user_id is not None:
+        where.append("o.user_id = %s")
+        params.append(user_id)
+    if date_from:
+        where.append("o.created_at >= %s")
+        params.append(date_from)
+    if date_to:
+        where.append("o.created_at < %s")
+        params.append(date_to + timedelta(days=1))
+
+    def page_query(table):
+        query = "SELECT %s, u.name AS user_name FROM %s o LEFT JOIN users u ON u.id = o.user_id" % (ORDER_COLUMNS, table)
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        return query + " ORDER BY o.id DESC LIMIT %s"
+
+    params.append(limit + 1)
+    query = page_query("orders")
+    if include_archived():
+        query = "(%s) UNION ALL (%s) ORDER BY id DESC LIMIT %%s" % (query, page_query("orders_archive"))
+        params = params + params + [limit + 1]
+
+    conn = get_db_connection()
+    with conn:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(query, params)
+        orders = cursor.fetchall()
+        cursor.close()
+
+    # One extra row tells us whether another page exists.
+    next_cursor = None
+    if len(orders) > limit:
+        orders = orders[:limit]
+        next_cursor = orders[-1]["id"]
+
+    return jsonify({"success": True, "orders": orders, "next_cursor": next_cursor})
+
+@app.route("/export-orders", methods=["GET"])
+def export_orders():
+    # ?format=csv|ndjson&from=YYYY-MM-DD&to=YYYY-MM-DD&status=..&status=..
+    # &user_id=&include_archived=1
+    # Streams every matching order with the buyer's name. Rows are
+    # read from an unbuffered cursor in batches (see order_export.py), so
+    # memory stays flat whatever the size. Archived orders come first.
+    fmt = request.args.get("format", "csv")
+    if fmt not in order_export.FORMATS:
+        return jsonify({"success": False, "message": "format must be one of " + ", ".join(order_export.FORMATS)}), 400
+    try:
+        user_id = request.args.get("user_id", type=int)
+        date_from = parse_date_arg("from")
+        date_to = parse_date_arg("to")
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid filter"}), 400
+    filters = {
+        "date_from": date_from,
+        "date_to": date_to + timedelta(days=1) if date_to else None,
+        "statuses": [status for status in request.args.getlist("status") if status],
+        "user_id": user_id,
+        "timeout_ms": STREAM_QUERY_TIMEOUT_MS,
+    }
+    tables = ("orders_archive", "orders") if include_archived() else ("orders",)
+    queries = [order_export.build_query(table, **filters) for table in tables]
+
+    conn = get_db_connection()
+
+    def cursors():
+        for query, params in queries:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            yield cursor
+            # Read to the end by now; one left part-read goes with the
+            # connection below.
+            cursor.close()
+
+    def body():
+        finished = False
+        try:
+            if fmt == "csv":
+                yield from order_export.csv_chunks(cursors())
+            else:
+                yield from order_export.ndjson_chunks(cursors(), app.json.dumps)
+            finished = True
+        except Exception:
+            # Raised on, as in stream_json_list: a cut-off file must not look
+            # like a complete one.
+            app.logger.exception("Error exporting orders")
+            raise
+        finally:
+            if finished:
+                conn.close()
+            else:
+                # The client went away or a fetch failed part-way: returning
+                # the connection to the pool would first read every row
+                # still to come.
+                conn.discard()
+
+    response = app.response_class(stream_with_context(body()), mimetype=order_export.FORMATS[fmt])
+    response.headers["Content-Disposition"] = 'attachment; filename="orders-%s.%s"' % (
+        datetime.now().strftime("%Y%m%d-%H%M%S"), fmt)
+    return stream_db_connection(response, conn)
 
 @app.route("/get-orders1", methods=["GET"])
 @login_required
 def get_user_orders():
     user_id = session["user_id"]
+    archived = include_archived()
 
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({"success": False, "message": "Database connection error"}), 500
-
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM orders WHERE user_id = %s ORDER BY id DESC", (user_id,))
-    orders = cursor.fetchall()
-    cursor.close()
-    conn.close()
+    def load():
+        conn = get_db_connection()
+        with conn:
+            cursor = conn.cursor(dictionary=True)
+            if archived:
+                cursor.execute("""
+                    SELECT %s FROM orders o WHERE o.user_id = %%s
+                    UNION ALL
+                    SELECT %s FROM orders_archive o WHERE o.user_id = %%s
+                    ORDER BY id DESC
+                """ % (ORDER_COLUMNS, ORDER_COLUMNS), (user_id, user_id))
+            else:
+                cursor.execute("SELECT * FROM orders WHERE user_id = %s ORDER BY id DESC", (user_id,))
+            orders = cursor.fetchall()
+            cursor.close()
+        return orders
 
+    orders = cached_for_user(user_id, "orders_archived" if archived else "orders", load)
     return jsonify({"success": True, "orders": orders})
 
 @app.route("/cancel-order", methods=["POST"])
@@ -507,22 +1190,33 @@ def cancel_order():
         return jsonify({"success": False, "message": "Order ID missing"}), 400
 
     conn = get_db_connection()
-    if not conn:
-        return jsonify({"success": False, "message": "Database connection error"}), 500
 
     cursor = conn.cursor()
     try:
-        cursor.execute("SELECT user_id FROM orders WHERE id = %s", (order_id,))
+        conn.start_transaction()
+        cursor.execute("""
+            SELECT user_id, DATE(created_at), pickles, status, quantity, cost
+            FROM orders WHERE id = %s FOR UPDATE
+        """, (order_id,))
         row = cursor.fetchone()
         if not row:
+            conn.rollback()
             return jsonify({"success": False, "message": "Order not found"}), 404
         if row[0] != user_id:
+            conn.rollback()
             return jsonify({"success": False, "message": "Unauthorized"}), 403
 
+        _, day, pickle, old_status, quantity, cost = row
         cursor.execute("DELETE FROM orders WHERE id = %s", (order_id,))
+        order_events.record(cursor, "cancelled", order_id=int(order_id), user_id=user_id)
+        sales.add(cursor, [(day, pickle, old_status, -1, -quantity, -cost)])
+        inventory.release(cursor, [(pickle, quantity)])
         conn.commit()
+        user_data_changed(user_id)
+        order_feed.poke()
         return jsonify({"success": True})
     except Exception as e:
+        conn.rollback()
         print("Error cancelling order:", e)
         return jsonify({"success": False, "message": "Failed to cancel order"}), 500
     finally:
@@ -538,55 +1232,274 @@ def update_order_status():
 
     if order_id is None or status is None:
         return jsonify({"success": False, "message": "Invalid data"}), 400
+    try:
+        order_id = int(order_id)
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "Invalid data"}), 400
 
     conn = get_db_connection()
-    if not conn:
-        return jsonify({"success": False, "message": "Database connection error"}), 500
 
     cursor = conn.cursor()
     try:
+        conn.start_transaction()
+        cursor.execute("""
+            SELECT user_id, DATE(created_at), pickles, status, quantity, cost
+            FROM orders WHERE id = %s FOR UPDATE
+        """, (order_id,))
+        row = cursor.fetchone()
+        if row is None:
+            conn.rollback()
+            return jsonify({"success": False, "message": "Order not found"}), 404
         cursor.execute("UPDATE orders SET status = %s WHERE id = %s", (status, order_id))
+        sales.add(cursor, status_moves([row[1:]], [status]))
+        order_events.record(cursor, "status-changed", order_id=order_id, status=status)
         conn.commit()
+        user_cache.invalidate(row[0])
+        order_feed.poke()
         return jsonify({"success": True})
     except Exception as e:
+        conn.rollback()
         print("Error updating order status:", e)
         return jsonify({"success": False, "message": "Failed to update status"}), 500
     finally:
         cursor.close()
         conn.close()
+ORDER_STATUSES = ("Ordered", "Packed", "Shipped", "Delivered")
+BULK_STATUS_MAX = 1000
+
+def status_moves(rows, statuses):
+    # sales deltas for moving each (day, pickle, status, quantity, cost) row
+    # to the matching new status.
+    moves = []
+    for (day, pickle, old_status, quantity, cost), status in zip(rows, statuses):
+        if sales.status_key(status) != old_status:
+            moves.append((day, pickle, old_status, -1, -quantity, -cost))
+            moves.append((day, pickle, status, 1, quantity, cost))
+    return moves
+
+def valid_order_status(status):
+    # true/false is what the dashboard checkbox sends for "done".
+    return isinstance(status, bool) or status in ORDER_STATUSES
+
+@app.route("/update-order-status-bulk", methods=["POST"])
+def update_order_status_bulk():
+    # {"updates": [{"id": 1, "status": "Shipped"}, ...]} applied with one
+    # UPDATE in one transaction.
+    data = request.get_json(silent=True) or {}
+    updates = data.get("updates")
+    if not isinstance(updates, list) or not updates:
+        return jsonify({"success": False, "message": "Invalid data"}), 400
+    if len(updates) > BULK_STATUS_MAX:
+        return jsonify({"success": False, "message": "At most %d updates per request" % BULK_STATUS_MAX}), 400
+
+    statuses = {}
+    for update in updates:
+        try:
+            order_id = int(update["id"])
+            status = update["status"]
+        except (KeyError, TypeError, ValueError):
+            return jsonify({"success": False, "message": "Invalid data"}), 400
+        if not valid_order_status(status):
+            return jsonify({"success": False, "message": "Invalid status for order %d" % order_id}), 400
+        statuses[order_id] = status  # the last change for an id wins
+
+    conn = get_db_connection()
+
+    ids = list(statuses)
+    id_list = ", ".join(["%s"] * len(ids))
+    cursor = conn.cursor()
+    try:
+        conn.start_transaction()
+        cursor.execute("""
+            SELECT id, DATE(created_at), pickles, status, quantity, cost, user_id
+            FROM orders WHERE id IN (%s) ORDER BY id FOR UPDATE
+        """ % id_list, ids)
+        current = cursor.fetchall()
+        found = [row[0] for row in current]
+        if found:
+            cursor.execute(
+                "UPDATE orders SET status = CASE id %s END WHERE id IN (%s)" % (
+                    " ".join(["WHEN %s THEN %s"] * len(found)), ", ".join(["%s"] * len(found))
+                ),
+                [value for order_id in found for value in (order_id, statuses[order_id])] + found,
+            )
+            sales.add(cursor, status_moves([row[1:6] for row in current], [statuses[order_id] for order_id in found]))
+            order_events.record_many(cursor, "status-changed", [
+                {"order_id": order_id, "status": statuses[order_id]} for order_id in found
+            ])
+        conn.commit()
+        user_cache.invalidate(*{row[6] for row in current})
+        order_feed.poke()
+        missing = sorted(set(ids) - set(found))
+        return jsonify({"success": True, "updated": len(found), "not_found": missing})
+    except Exception as e:
+        conn.rollback()
+        print("Error updating order statuses:", e)
+        return jsonify({"success": False, "message": "Failed to update statuses"}), 500
+    finally:
+        cursor.close()
+        conn.close()
+
+# ------------------- Sales Report -------------------
+
+SALES_REPORT_DAYS = 30
+SALES_REPORT_MAX = 500
+
+@app.route("/sales-report", methods=["GET"])
+def sales_report():
+    # ?group=pickle|day|status&from=YYYY-MM-DD&to=YYYY-MM-DD&limit=N, read
+    # from the sales_daily counters (see sales.py), never from orders.
+    group = request.args.get("group", "pickle")
+    if group not in sales.REPORT_GROUPS:
+        return jsonify({"success": False, "message": "group must be one of " + ", ".join(sales.REPORT_GROUPS)}), 400
+    try:
+        date_to = (parse_date_arg("to") or datetime.now()).date()
+        date_from = parse_date_arg("from")
+        date_from = date_from.date() if date_from else date_to - timedelta(days=SALES_REPORT_DAYS - 1)
+        limit = min(int(request.args.get("limit", SALES_REPORT_MAX)), SALES_REPORT_MAX)
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid filter"}), 400
+
+    conn = get_db_connection()
+
+    cursor = conn.cursor(dictionary=True)
+    try:
+        rows = sales.report(cursor, group, date_from, date_to, limit)
+    finally:
+        cursor.close()
+        conn.close()
+
+    totals = {
+        "orders": sum(row["orders"] for row in rows),
+        "quantity": sum(row["quantity"] for row in rows),
+        "revenue": sum(row["revenue"] for row in rows),
+    }
+    return jsonify({
+        "success": True,
+        "group": group,
+        "from": date_from.isoformat(),
+        "to": date_to.isoformat(),
+        "rows": rows,
+        "totals": totals,
+    })
+
+# ------------------- Order Events -------------------
+
+ORDER_STREAM_SECONDS = float(os.getenv("ORDER_EVENTS_STREAM_SECONDS", "300"))
+ORDER_STREAM_HEARTBEAT = 15
+# Each open stream occupies a server thread; cap them so dashboards can
+# never take every thread from regular requests. See WEB_THREADS.
+order_stream_slots = threading.BoundedSemaphore(
+    int(os.getenv("ORDER_EVENTS_MAX_STREAMS", max(1, WEB_THREADS // 4)))
+)
+
+def order_event_cursor():
+    since = request.headers.get("Last-Event-ID", type=int)
+    if since is None:
+        since = request.args.get("since", type=int)
+    return since
+
+def sse_message(kind, data, event_id=None):
+    message = "event: %s\ndata: %s\n" % (kind, json.dumps(data, default=str))
+    if event_id is not None:
+        message = "id: %s\n" % event_id + message
+    return message + "\n"
+
+@app.route("/order-events", methods=["GET"])
+def order_events_stream():
+    # Server-Sent Events for the owner dashboard. Reconnecting clients send
+    # Last-Event-ID and only receive what they missed; a "reset" event means
+    # the gap is too old and the dashboard must reload.
+    if not order_stream_slots.acquire(blocking=False):
+        response = jsonify({"success": False, "message": "Too many open streams"})
+        response.headers["Retry-After"] = "5"
+        return response, 503
+
+    since = order_event_cursor()
+
+    def stream():
+        last = since
+        if last is None:
+            last = order_feed.cursor()
+        yield "retry: 3000\n\n"
+        yield sse_message("ready", {"cursor": last}, last)
+        # Streams end after a while; EventSource reconnects on its own and
+        # that keeps threads from being held forever by idle tabs.
+        deadline = time.monotonic() + ORDER_STREAM_SECONDS
+        while time.monotonic() < deadline:
+            events = order_feed.wait(last, ORDER_STREAM_HEARTBEAT)
+            if events is None:
+                last = order_feed.cursor()
+                yield sse_message("reset", {"cursor": last}, last)
+            elif not events:
+                yield ": keep-alive\n\n"
+            for event in events or []:
+                last = event["id"]
+                yield sse_message(event["kind"], event["data"], last)
+
+    response = Response(stream(), mimetype="text/event-stream")
+    # Not the generator's finally: it never runs for a HEAD request or a
+    # client that leaves before the first chunk. The server always closes
+    # the response.
+    response.call_on_close(order_stream_slots.release)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+@app.route("/order-events/poll", methods=["GET"])
+def order_events_poll():
+    # Fallback for dashboards without a stream: waits up to 25s for events
+    # after ?since=. With every stream slot taken it answers at once and
+    # tells the client when to ask again, so it never holds a thread past
+    # the cap and never turns the dashboard away.
+    since = order_event_cursor()
+    if since is None:
+        return jsonify({"success": True, "events": [], "cursor": order_feed.cursor()})
+    retry_after = None
+    if order_stream_slots.acquire(blocking=False):
+        try:
+            events = order_feed.wait(since, 25)
+        finally:
+            order_stream_slots.release()
+    else:
+        events = order_feed.since(since)
+        retry_after = 5
+    if events is None:
+        return jsonify({"success": True, "events": [], "reset": True, "cursor": order_feed.cursor()})
+    cursor = events[-1]["id"] if events else since
+    return jsonify({"success": True, "events": events, "cursor": cursor, "retry_after": retry_after})
+
 # ------------------- Profile APIs -------------------
 
 @app.route("/get-profile", methods=["GET"])
 @login_required
 def get_profile():
     user_id = session["user_id"]
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({"success": False, "message": "Database connection error"}), 500
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT name, email FROM users WHERE id = %s", (user_id,))
-    user = cursor.fetchone()
-    cursor.close()
-    conn.close()
 
+    def load():
+        conn = get_db_connection()
+        with conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("SELECT name, email FROM users WHERE id = %s", (user_id,))
+            user = cursor.fetchone()
+            cursor.close()
+        return user
+
+    user = cached_for_user(user_id, "profile", load)
     if user:
         return jsonify({"success": True, "user": user})
     return jsonify({"success": False, "message": "User not found"}), 404
 
 @app.route('/getusers', methods=['GET'])
 def get_users():
+    conn = get_db_connection()
     try:
-        conn = get_db_connection()
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT id, name FROM users")
-        users = cursor.fetchall()
-        return jsonify(success=True, users=users)
+        cursor.execute(streamed_select("SELECT id, name FROM users"))
     except Exception as e:
+        conn.close()
         return jsonify(success=False, message=str(e))
-    finally:
-        if conn.is_connected():
-            cursor.close()
-            conn.close()
+    return stream_json_list("users", conn, cursor)
 @app.route("/update-profile", methods=["POST"])
 @login_required
 def update_profile():
@@ -598,8 +1511,6 @@ def update_profile():
     user_id = session["user_id"]
 
     conn = get_db_connection()
-    if not conn:
-        return jsonify({"success": False, "message": "Database connection error"}), 500
 
     cursor = conn.cursor(dictionary=True)
     cursor.execute("SELECT password FROM users WHERE id = %s", (user_id,))
@@ -625,10 +1536,80 @@ def update_profile():
     conn.commit()
     cursor.close()
     conn.close()
+    user_data_changed(user_id)
+    session["user_name"] = name
 
     return jsonify({"success": True})
+
+@app.route("/db-pool-stats", methods=["GET"])
+def db_pool_stats():
+    return jsonify({
+        "success": True,
+        "pool": db_pool.stats(),
+        "replicas": {pool.name: pool.stats() for pool in read_replicas.pools},
+        "replica_routing": read_replicas.stats(),
+    })
+
+QUERY_STATS_SORTS = ("total_seconds", "mean_seconds", "max_seconds", "calls", "slow")
+
+@app.route("/admin/query-stats", methods=["GET", "DELETE"])
+def admin_query_stats():
+    # GET ?sort=total_seconds|mean_seconds|max_seconds|calls|slow&limit=N
+    # lists statement fingerprints for this process; DELETE starts over.
+    if request.method == "DELETE":
+        query_stats.reset()
+        return jsonify({"success": True})
+    sort = request.args.get("sort", "total_seconds")
+    if sort not in QUERY_STATS_SORTS:
+        return jsonify({"success": False, "message": "sort must be one of " + ", ".join(QUERY_STATS_SORTS)}), 400
+    limit = request.args.get("limit", type=int)
+    return jsonify({
+        "success": True,
+        "pid": os.getpid(),
+        "slow_threshold": query_stats.slow_threshold,
+        "totals": query_stats.totals(),
+        "queries": query_stats.snapshot(sort, limit),
+    })
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return app.response_class(request_metrics.render(), mimetype="text/plain; version=0.0.4")
+# ------------------- Warm-up -------------------
+
+def reset_after_fork():
+    # Pool sockets must not be shared with the parent process.
+    db_pool.reset_after_fork()
+    read_replicas.reset_after_fork()
+    user_cache.clear()
+
+def warm_up():
+    # Run in each worker before it takes traffic (see serve.py) so the first
+    # requests after a deploy do not pay for connecting, compiling templates
+    # or loading the catalog.
+    started = time.perf_counter()
+    query_stats.start()
+    app.jinja_env.get_template("demo.html")
+    static_pages.load_all()
+    try:
+        # A database that is down must not keep the worker from starting.
+        db_pool.prefill(int(os.getenv("DB_POOL_WARM", db_pool.size)))
+        if read_replicas:
+            read_replicas.prefill(int(os.getenv("DB_READ_POOL_WARM", "1")))
+        conn = get_background_connection()
+        if conn:
+            with conn:
+                version, products = catalog_cache.get_products(conn)
+            with app.test_request_context("/products"):
+                product_page_parts(version, products)
+                products_json(version, products)
+            product_index.sync(version, products)
+    except Exception as e:
+        print("Error warming up database:", e)
+    return time.perf_counter() - started
+
 # ------------------- Run App -------------------
 
 if __name__ == "__main__":
+    query_stats.start()
     app.run(host="0.0.0.0", port=5050)
 
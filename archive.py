@@ -0,0 +1,107 @@
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+from migrations import connect
+
+
+# ------------------- Order Archive -------------------
+#
+#   python archive.py                 move finished orders older than 90 days
+#   python archive.py --dry-run       only count what would move
+#
+# Finished orders are copied to orders_archive and deleted from orders in
+# small batches, each its own short transaction, with a pause in between so
+# checkout never waits long on the rows being moved. The hot orders table
+# (and its indexes) then only holds recent and still-open orders. Readers
+# that need full history pass include_archived=1.
+
+ORDER_COLUMNS = "id, user_id, pickles, quantity, cost, status, created_at"
+
+
+def move_batch(conn, statuses, cutoff, batch):
+    # Returns how many orders were moved.
+    cursor = conn.cursor()
+    try:
+        conn.start_transaction()
+        cursor.execute(
+            "SELECT id FROM orders WHERE status IN (%s) AND created_at < %%s ORDER BY id LIMIT %%s FOR UPDATE"
+            % ", ".join(["%s"] * len(statuses)),
+            (*statuses, cutoff, batch),
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+        if not ids:
+            conn.rollback()
+            return 0
+        placeholders = ", ".join(["%s"] * len(ids))
+        cursor.execute(
+            "INSERT IGNORE INTO orders_archive (%s) SELECT %s FROM orders WHERE id IN (%s)"
+            % (ORDER_COLUMNS, ORDER_COLUMNS, placeholders),
+            ids,
+        )
+        cursor.execute("DELETE FROM orders WHERE id IN (%s)" % placeholders, ids)
+        conn.commit()
+        return len(ids)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def count_pending(conn, statuses, cutoff):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT COUNT(*) FROM orders WHERE status IN (%s) AND created_at < %%s"
+            % ", ".join(["%s"] * len(statuses)),
+            (*statuses, cutoff),
+        )
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move finished orders to orders_archive")
+    parser.add_argument("--days", type=int, default=int(os.getenv("ARCHIVE_AFTER_DAYS", "90")),
+                        help="archive orders older than this many days")
+    parser.add_argument("--statuses", default=os.getenv("ARCHIVE_STATUSES", "Delivered,1"),
+                        help="comma-separated order statuses that count as finished")
+    parser.add_argument("--batch", type=int, default=1000, help="orders per transaction")
+    parser.add_argument("--pause", type=float, default=0.2, help="seconds to sleep between batches")
+    parser.add_argument("--max-batches", type=int, help="stop after this many batches")
+    parser.add_argument("--dry-run", action="store_true", help="only report how many orders would move")
+    args = parser.parse_args(argv)
+
+    statuses = [s.strip() for s in args.statuses.split(",") if s.strip()]
+    if not statuses:
+        parser.error("--statuses must name at least one status")
+    cutoff = datetime.now() - timedelta(days=args.days)
+
+    conn = connect()
+    try:
+        if args.dry_run:
+            print("%d orders would be archived" % count_pending(conn, statuses, cutoff))
+            return 0
+        moved = batches = 0
+        while args.max_batches is None or batches < args.max_batches:
+            count = move_batch(conn, statuses, cutoff, args.batch)
+            if not count:
+                break
+            moved += count
+            batches += 1
+            print("archived %d orders (%d total)" % (count, moved))
+            if count < args.batch:
+                break
+            time.sleep(args.pause)
+        print("done: %d orders archived in %d batches" % (moved, batches))
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
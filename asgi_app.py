@@ -0,0 +1,400 @@
+import asyncio
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from decimal import Decimal
+
+import aiomysql
+import pymysql
+from a2wsgi import WSGIMiddleware
+from itsdangerous import BadSignature
+from starlette.applications import Starlette
+from starlette.responses import RedirectResponse, Response
+from starlette.routing import Route
+from werkzeug.http import parse_etags, quote_etag
+
+import app as sync_app
+from cart_store import LOAD_SQL, cart_lines
+from catalog_cache import PRODUCTS_SQL
+from db_pool import CircuitBreaker, DatabaseUnavailable
+from hashing import HashingBusy
+from user_cache import MISS
+
+
+# ------------------- Async Server -------------------
+#
+#   uvicorn asgi_app:application --workers 4 --port 5050
+#
+# The busiest JSON endpoints (the routes below) run as coroutines on an
+# aiomysql pool: a request waiting on MySQL or on a slow client is a
+# suspended coroutine, not a parked thread, so one process holds thousands
+# of open connections. Every other request goes to the Flask app in app.py
+# through a pool of WEB_THREADS threads, unchanged.
+#
+# Sessions are read and written with the Flask app's own session interface
+# and signing key, so a cookie from either half works on every route, and
+# responses are encoded by the Flask app's JSON provider. Carts are written
+# through to the cart table (no in-memory CartStore) so both halves always
+# agree on them. Async reads always go to the writer.
+
+# Both halves must see the same carts; see above.
+sync_app.cart_store.max_users = 0
+
+flask_app = sync_app.app
+session_interface = flask_app.session_interface
+
+db_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv("DB_BREAKER_FAILURES", "5")),
+    reset_timeout=float(os.getenv("DB_BREAKER_RESET_SECONDS", "10")),
+)
+ACQUIRE_TIMEOUT = float(os.getenv("ASYNC_DB_POOL_TIMEOUT", os.getenv("DB_POOL_TIMEOUT", "5")))
+db_pool = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global db_pool
+    db_pool = await aiomysql.create_pool(
+        host=os.getenv("DB_HOST"),
+        port=int(os.getenv("DB_PORT") or 3306),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        db=os.getenv("DB_NAME"),
+        minsize=int(os.getenv("ASYNC_DB_POOL_MIN", "1")),
+        maxsize=int(os.getenv("ASYNC_DB_POOL_SIZE", "20")),
+        pool_recycle=int(float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))),
+        connect_timeout=sync_app.DB_CONNECT_TIMEOUT,
+        # Reads see the latest commit; there are no multi-statement writes.
+        autocommit=True,
+        init_command="SET SESSION max_execution_time = %d, SESSION innodb_lock_wait_timeout = %d" % (
+            sync_app.DB_QUERY_TIMEOUT_MS, sync_app.DB_LOCK_WAIT_TIMEOUT),
+    )
+    # Connections, templates and the catalog for the Flask half (serve.py
+    # does the same for gunicorn workers).
+    await asyncio.to_thread(sync_app.warm_up)
+    try:
+        yield
+    finally:
+        db_pool.close()
+        await db_pool.wait_closed()
+
+
+def pool_stats():
+    if db_pool is None:
+        return {}
+    stats = {"size": db_pool.size, "free": db_pool.freesize, "max_size": db_pool.maxsize}
+    stats["in_use"] = stats["size"] - stats["free"]
+    stats.update(db_breaker.stats())
+    return stats
+
+
+sync_app.request_metrics.add_gauges("async_db_pool", pool_stats)
+
+
+@asynccontextmanager
+async def db_cursor(dictionary=True):
+    # A cursor on a pooled connection, the async counterpart of
+    # get_db_connection(): DatabaseUnavailable when there is none to be had.
+    db_breaker.before()
+    try:
+        conn = await asyncio.wait_for(db_pool.acquire(), ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError:
+        db_breaker.abandon()
+        raise DatabaseUnavailable("Timed out waiting for a database connection", retry_after=1)
+    except (pymysql.err.Error, OSError) as e:
+        db_breaker.failure()
+        print("Error connecting to MySQL:", e)
+        raise DatabaseUnavailable(str(e), retry_after=1)
+    db_breaker.success()
+    try:
+        async with conn.cursor(aiomysql.DictCursor if dictionary else aiomysql.Cursor) as cursor:
+            yield cursor
+    except BaseException:
+        # Failed or cancelled (the client went away) part way through: the
+        # connection may be mid-query, so it is dropped.
+        conn.close()
+        raise
+    finally:
+        db_pool.release(conn)
+
+
+async def execute(cursor, statement, params=()):
+    # Timed into /admin/query-stats like the Flask half's pooled cursors.
+    started = time.perf_counter()
+    try:
+        await cursor.execute(statement, params)
+    finally:
+        observer = sync_app.db_pool.statement_observer
+        if observer:
+            observer(statement, params, time.perf_counter() - started)
+
+
+# ------------------- Sessions and Responses -------------------
+
+def open_session(request):
+    # SecureCookieSessionInterface.open_session() for a Starlette request.
+    cookie = request.cookies.get(session_interface.get_cookie_name(flask_app))
+    if not cookie:
+        return session_interface.session_class()
+    max_age = int(flask_app.permanent_session_lifetime.total_seconds())
+    try:
+        data = session_interface.get_signing_serializer(flask_app).loads(cookie, max_age=max_age)
+    except BadSignature:
+        return session_interface.session_class()
+    return session_interface.session_class(data)
+
+
+def save_session(session, response):
+    # SecureCookieSessionInterface.save_session() for a Starlette response.
+    name = session_interface.get_cookie_name(flask_app)
+    options = dict(
+        domain=session_interface.get_cookie_domain(flask_app),
+        path=session_interface.get_cookie_path(flask_app),
+        secure=session_interface.get_cookie_secure(flask_app),
+        samesite=session_interface.get_cookie_samesite(flask_app),
+        httponly=session_interface.get_cookie_httponly(flask_app),
+    )
+    if session.accessed:
+        response.headers.append("Vary", "Cookie")
+    if not session:
+        if session.modified:
+            response.delete_cookie(name, **options)
+        return
+    if not session_interface.should_set_cookie(flask_app, session):
+        return
+    value = session_interface.get_signing_serializer(flask_app).dumps(dict(session))
+    response.set_cookie(name, value, expires=session_interface.get_expiration_time(flask_app, session), **options)
+
+
+def json_response(obj, status=200):
+    return Response(flask_app.json.dump_bytes(obj), status_code=status, media_type=flask_app.json.mimetype)
+
+
+def busy_response(message, retry_after):
+    response = json_response({"success": False, "message": message}, 503)
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
+
+def is_json(request):
+    mimetype = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    return mimetype == "application/json" or (mimetype.startswith("application/") and mimetype.endswith("+json"))
+
+
+async def request_json(request):
+    try:
+        return json.loads(await request.body())
+    except ValueError:
+        return None
+
+
+def endpoint(handler, login_required=False):
+    # Wraps `handler(request, session)` with what Flask gives its views: the
+    # session, @login_required, the 503 error handlers and remember_write.
+    async def view(request):
+        session = open_session(request)
+        if login_required and "user_id" not in session:
+            if request.url.path.startswith("/api") or is_json(request):
+                response = json_response({"success": False, "message": "Not logged in"}, 401)
+            else:
+                response = RedirectResponse("/index.html", status_code=302)
+        else:
+            try:
+                response = await handler(request, session)
+            except DatabaseUnavailable as e:
+                response = busy_response("Database unavailable, please try again", e.retry_after)
+            except HashingBusy:
+                response = busy_response("Server busy, please try again", 1)
+        if (sync_app.read_replicas and request.method not in ("GET", "HEAD", "OPTIONS")
+                and response.status_code < 400):
+            session["wrote_at"] = time.time()
+        save_session(session, response)
+        return response
+    return view
+
+
+# ------------------- Async Routes -------------------
+
+async def current_catalog():
+    # As app.current_catalog(), sharing the same CatalogCache.
+    catalog = sync_app.catalog_cache
+    try:
+        async with db_cursor() as cursor:
+            await execute(cursor, "SELECT version FROM catalog_meta WHERE id = 1")
+            row = await cursor.fetchone()
+            version = row["version"] if row else 0
+            cached = catalog.last()
+            if cached is not None and cached[0] == version:
+                return cached
+            await execute(cursor, PRODUCTS_SQL)
+            products = list(await cursor.fetchall())
+    except (DatabaseUnavailable, pymysql.err.Error):
+        cached = catalog.last()
+        if cached is None:
+            raise
+        return cached
+    catalog.store(version, products)
+    return version, products
+
+
+async def get_products(request, session):
+    version, products = await current_catalog()
+    # As app.conditional_response().
+    etag = "products-json-%s" % version
+    if etag in parse_etags(request.headers.get("if-none-match")):
+        response = Response(status_code=304)
+    else:
+        response = Response(sync_app.products_json(version, products), media_type=flask_app.json.mimetype)
+    response.headers["ETag"] = quote_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+async def get_cart(request, session):
+    user_id = session["user_id"]
+    try:
+        async with db_cursor(dictionary=False) as cursor:
+            await execute(cursor, LOAD_SQL, (user_id,))
+            rows = await cursor.fetchall()
+    except DatabaseUnavailable:
+        raise
+    except Exception as e:
+        print("Error fetching cart:", e)
+        return json_response({"success": False, "message": "Failed to load cart"}, 500)
+    return json_response({"success": True, "cart": [line.as_dict(user_id) for line in cart_lines(rows).values()]})
+
+
+async def add_to_cart(request, session):
+    data = await request_json(request)
+    if not isinstance(data, dict):
+        return json_response({"success": False, "message": "Invalid JSON"}, 400)
+    items = data.get("items", [])
+
+    user_id = session.get("user_id")
+    if not user_id:
+        return json_response({"success": False, "message": "Not logged in"}, 401)
+
+    # The rows the write-through CartStore inserts: one per pickle.
+    totals = {}
+    for item in items:
+        pickle_name = item.get("pickle_name")
+        quantity = item.get("quantity")
+        cost = item.get("cost")
+        if not pickle_name or not quantity or not cost:
+            continue  # skip invalid
+        try:
+            quantity, cost = int(quantity), Decimal(str(cost))
+        except (TypeError, ValueError, ArithmeticError):
+            continue
+        if quantity < 1:
+            return json_response({"success": False, "message": "Invalid item"}, 400)
+        line = totals.setdefault(pickle_name, [0, Decimal(0)])
+        line[0] += quantity
+        line[1] += cost
+
+    try:
+        if totals:
+            async with db_cursor(dictionary=False) as cursor:
+                await execute(
+                    cursor,
+                    "INSERT INTO cart (user_id, pickle_name, quantity, cost) VALUES "
+                    + ", ".join(["(%s, %s, %s, %s)"] * len(totals)),
+                    [value for pickle_name, (quantity, cost) in totals.items()
+                     for value in (user_id, pickle_name, quantity, cost)],
+                )
+        return json_response({"success": True})
+    except DatabaseUnavailable:
+        raise
+    except Exception as e:
+        print("Error adding to cart:", e)
+        return json_response({"success": False, "message": str(e)})
+
+
+async def get_user_orders(request, session):
+    user_id = session["user_id"]
+    archived = request.query_params.get("include_archived") in ("1", "true")
+    kind = "orders_archived" if archived else "orders"
+
+    # The same UserCache as app.get_user_orders(), loaded here without a
+    # thread.
+    orders = sync_app.user_cache.peek(user_id, kind, session.get("user_cache_stamp"))
+    if orders is MISS:
+        loaded_at = time.time()
+        async with db_cursor() as cursor:
+            if archived:
+                await execute(cursor, """
+                    SELECT %s FROM orders o WHERE o.user_id = %%s
+                    UNION ALL
+                    SELECT %s FROM orders_archive o WHERE o.user_id = %%s
+                    ORDER BY id DESC
+                """ % (sync_app.ORDER_COLUMNS, sync_app.ORDER_COLUMNS), (user_id, user_id))
+            else:
+                await execute(cursor, "SELECT * FROM orders WHERE user_id = %s ORDER BY id DESC", (user_id,))
+            orders = list(await cursor.fetchall())
+        sync_app.user_cache.put(user_id, kind, orders, loaded_at)
+    return json_response({"success": True, "orders": orders})
+
+
+async def login(request, session):
+    data = await request_json(request)
+    if not isinstance(data, dict):
+        return json_response({"success": False, "message": "Invalid JSON"}, 400)
+    email = data.get("email")
+    password = data.get("password")
+
+    async with db_cursor() as cursor:
+        await execute(cursor, "SELECT * FROM users WHERE email = %s", (email,))
+        user = await cursor.fetchone()
+
+    # The hash runs in PasswordHasher's process pool; a thread only waits.
+    if user and await asyncio.to_thread(sync_app.verify_password, user["password"], password):
+        await rehash_if_needed(user["id"], user["password"], password)
+        session.permanent = True
+        session["user_id"] = user["id"]
+        session["user_name"] = user["name"]
+        return json_response({"success": True})
+    return json_response({"success": False, "message": "Invalid credentials"})
+
+
+async def rehash_if_needed(user_id, stored_hash, password):
+    # As app.rehash_if_needed(); failing here must not fail the login.
+    if not sync_app.password_hasher.needs_rehash(stored_hash):
+        return
+    try:
+        new_hash = await asyncio.to_thread(sync_app.hash_password, password)
+        async with db_cursor(dictionary=False) as cursor:
+            await execute(cursor, "UPDATE users SET password = %s WHERE id = %s AND password = %s",
+                          (new_hash, user_id, stored_hash))
+    except Exception as e:
+        print("Error rehashing password:", e)
+
+
+async_app = Starlette(
+    routes=[
+        Route("/get-products", endpoint(get_products), methods=["GET"]),
+        Route("/get_cart", endpoint(get_cart, login_required=True), methods=["GET"]),
+        Route("/add_to_cart", endpoint(add_to_cart, login_required=True), methods=["POST"]),
+        Route("/get-orders1", endpoint(get_user_orders, login_required=True), methods=["GET"]),
+        Route("/login", endpoint(login), methods=["POST"]),
+    ],
+    lifespan=lifespan,
+)
+
+# (path, method) pairs answered above; HEAD comes with GET.
+ASYNC_ROUTES = {
+    (route.path, method) for route in async_app.routes for method in route.methods
+}
+
+
+# ------------------- Dispatch -------------------
+
+wsgi_app = WSGIMiddleware(flask_app, workers=int(os.getenv("WEB_THREADS", "8")))
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "http" and (scope["path"], scope["method"]) not in ASYNC_ROUTES:
+        await wsgi_app(scope, receive, send)
+    else:
+        # Lifespan events go here too, to open and close the pool.
+        await async_app(scope, receive, send)
@@ -0,0 +1,147 @@
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+from bench import standin_db
+from bench.run import percentile
+
+
+# ------------------- Checkout Contention -------------------
+#
+#   python -m bench.contention                      64 buyers, 2000 jars
+#   python -m bench.contention --buyers 200 --stock 500 --quantity 2
+#   python -m bench.contention --route cart         via add_to_cart + checkout
+#
+# Every buyer goes after the same hot pickle until it is sold out. Reports
+# checkout throughput and latency, and checks that exactly the stock was
+# sold: no order beyond the last jar, none lost. SQLite takes one writer at a
+# time, so the throughput here is a floor for comparing runs; on MySQL only
+# the product row is contended.
+
+HOT_PICKLE = "Hot Mango Pickle"
+PRICE = 120
+
+
+def seed(path, buyers, stock):
+    standin_db.create(path)
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO users (name, email, password) VALUES (?, ?, ?)",
+        [("Buyer %d" % i, "buyer%d@bench.local" % i, "-") for i in range(buyers)],
+    )
+    conn.execute(
+        "INSERT INTO products (name, image_url, price, stock) VALUES (?, ?, ?, ?)",
+        (HOT_PICKLE, "/img/hot.png", PRICE, stock),
+    )
+    conn.commit()
+    conn.close()
+
+
+class Buyer(threading.Thread):
+    def __init__(self, app, user_id, args, start, results, lock):
+        super().__init__(daemon=True)
+        self.client = app.test_client()
+        self.user_id = user_id
+        self.args = args
+        self.start_event = start
+        self.results = results
+        self.lock = lock
+        self.retrying = False
+
+    def checkout(self):
+        item = {"pickle_name": HOT_PICKLE, "quantity": self.args.quantity, "cost": PRICE * self.args.quantity}
+        if self.args.route == "buy_now":
+            return self.client.post("/buy_now", json=item)
+        if self.retrying:
+            # The failed checkout left its line in the cart; without this
+            # the retry would order both.
+            self.client.post("/remove_cart_item", json={"pickle_name": HOT_PICKLE})
+        self.client.post("/add_to_cart", json={"items": [item]})
+        return self.client.post("/place_order_from_cart")
+
+    def run(self):
+        with self.client.session_transaction() as session:
+            session["user_id"] = self.user_id
+        self.start_event.wait()
+        while True:
+            started = time.perf_counter()
+            response = self.checkout()
+            elapsed = time.perf_counter() - started
+            self.retrying = response.status_code != 200
+            with self.lock:
+                if response.status_code == 200:
+                    self.results["latencies"].append(elapsed)
+                elif response.status_code == 409:
+                    self.results["sold_out"] += 1
+                else:
+                    self.results["errors"] += 1
+            if response.status_code == 409:
+                return
+            if response.status_code != 200:
+                # Lock timeouts and the like: try again, within reason.
+                with self.lock:
+                    if self.results["errors"] > self.args.max_errors:
+                        return
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent checkouts of one hot pickle")
+    parser.add_argument("--buyers", type=int, default=64, help="concurrent buyers (threads)")
+    parser.add_argument("--stock", type=int, default=2000)
+    parser.add_argument("--quantity", type=int, default=1, help="jars per checkout")
+    parser.add_argument("--route", choices=("buy_now", "cart"), default="buy_now")
+    parser.add_argument("--max-errors", type=int, default=1000, help="give up after this many failed checkouts")
+    args = parser.parse_args(argv)
+
+    # No caching between the cart and checkout: every add writes through.
+    os.environ.setdefault("CART_STORE", "0")
+
+    workdir = tempfile.mkdtemp(prefix="pickle-contention-")
+    db_path = os.path.join(workdir, "contention.sqlite3")
+    seed(db_path, args.buyers, args.stock)
+
+    import app as app_module
+
+    app_module.db_pool.dispose()
+    app_module.db_pool.connect = standin_db.connector(db_path)
+
+    start = threading.Event()
+    lock = threading.Lock()
+    results = {"latencies": [], "sold_out": 0, "errors": 0}
+    buyers = [Buyer(app_module.app, n + 1, args, start, results, lock) for n in range(args.buyers)]
+    for buyer in buyers:
+        buyer.start()
+    started = time.perf_counter()
+    start.set()
+    for buyer in buyers:
+        buyer.join()
+    wall = time.perf_counter() - started
+
+    conn = sqlite3.connect(db_path)
+    left = conn.execute("SELECT stock FROM products WHERE name = ?", (HOT_PICKLE,)).fetchone()[0]
+    sold = conn.execute("SELECT COALESCE(SUM(quantity), 0) FROM orders WHERE pickles = ?", (HOT_PICKLE,)).fetchone()[0]
+    conn.close()
+
+    latencies = sorted(results["latencies"])
+    print("%d buyers, %d jars, %d per checkout, via %s" % (args.buyers, args.stock, args.quantity, args.route))
+    print("checkouts      %8d  (%.1f/s over %.2fs)" % (len(latencies), len(latencies) / wall, wall))
+    print("sold out (409) %8d" % results["sold_out"])
+    print("errors         %8d" % results["errors"])
+    print("latency ms     p50 %.2f  p95 %.2f  p99 %.2f" % tuple(
+        percentile(latencies, pct) * 1000 for pct in (50, 95, 99)
+    ))
+    print("stock left     %8d" % left)
+    print("jars ordered   %8d" % sold)
+
+    if sold + left != args.stock or left < 0 or sold != len(latencies) * args.quantity:
+        print("MISMATCH: %d ordered + %d left != %d stocked" % (sold, left, args.stock))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
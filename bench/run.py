@@ -0,0 +1,274 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from werkzeug.security import generate_password_hash
+
+from bench import standin_db
+
+
+# ------------------- Load Test -------------------
+#
+#   python -m bench.run                               run the default mix
+#   python -m bench.run --save-baseline               ...and store the result
+#   python -m bench.run --compare bench/baseline.json fail on p95 regressions
+#
+# Boots app.py in-process against a seeded SQLite stand-in (see standin_db)
+# and replays a weighted mix of requests from several threads through Flask
+# test clients. Nothing touches the network.
+
+DEFAULT_MIX = {
+    "browse": 40,
+    "login": 5,
+    "add_to_cart": 20,
+    "checkout": 5,
+    "my_orders": 25,
+    "owner_orders": 5,
+}
+
+BENCH_PASSWORD = "bench-password"
+
+
+def seed(path, users, products, cart_rows, orders, rng):
+    import sqlite3
+
+    standin_db.create(path)
+    conn = sqlite3.connect(path)
+    # Hashing once keeps seeding fast; logins still pay the full verify cost.
+    password = generate_password_hash(BENCH_PASSWORD)
+    conn.executemany(
+        "INSERT INTO users (name, email, password) VALUES (?, ?, ?)",
+        [("User %d" % i, "user%d@bench.local" % i, password) for i in range(users)],
+    )
+    conn.executemany(
+        "INSERT INTO products (name, image_url, price) VALUES (?, ?, ?)",
+        [("Pickle %d" % i, "/img/%d.png" % i, rng.randint(50, 500)) for i in range(products)],
+    )
+    conn.executemany(
+        "INSERT INTO cart (user_id, pickle_name, quantity, cost) VALUES (?, ?, ?, ?)",
+        [(rng.randint(1, users), "Pickle %d" % rng.randrange(products), 1, 100) for _ in range(cart_rows)],
+    )
+    statuses = ("Ordered", "Shipped", "Delivered", "1")
+    conn.executemany(
+        "INSERT INTO orders (user_id, pickles, quantity, cost, status, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (
+                rng.randint(1, users),
+                "Pickle %d" % rng.randrange(products),
+                rng.randint(1, 5),
+                rng.randint(50, 2500),
+                rng.choice(statuses),
+                "2025-%02d-%02d 12:00:00" % (rng.randint(1, 12), rng.randint(1, 28)),
+            )
+            for _ in range(orders)
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError("unknown scenario %r" % name)
+        mix[name] = int(weight)
+    return mix
+
+
+class Worker(threading.Thread):
+    def __init__(self, app, args, mix, count, seed_value, results, lock):
+        super().__init__(daemon=True)
+        self.client = app.test_client()
+        self.args = args
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+        self.count = count
+        self.rng = random.Random(seed_value)
+        self.results = results
+        self.lock = lock
+
+    def log_in_as(self, user_id):
+        with self.client.session_transaction() as session:
+            session["user_id"] = user_id
+
+    def timed(self, endpoint, call):
+        started = time.perf_counter()
+        response = call()
+        # Read through and closed as a WSGI server would: a streamed body
+        # is only built while it is read, and returns its connection to the
+        # pool when the response is closed.
+        response.get_data()
+        response.close()
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            bucket = self.results.setdefault(endpoint, {"latencies": [], "errors": 0})
+            bucket["latencies"].append(elapsed)
+            if response.status_code >= 400:
+                bucket["errors"] += 1
+
+    def add_items(self):
+        items = [
+            {"pickle_name": "Pickle %d" % self.rng.randrange(self.args.products), "quantity": 1, "cost": 100}
+            for _ in range(self.rng.randint(1, 3))
+        ]
+        return lambda: self.client.post("/add_to_cart", json={"items": items})
+
+    def run(self):
+        for _ in range(self.count):
+            scenario = self.rng.choices(self.names, self.weights)[0]
+            user_id = self.rng.randint(1, self.args.users)
+            if scenario == "browse":
+                self.timed("/products", lambda: self.client.get("/products"))
+            elif scenario == "login":
+                email = "user%d@bench.local" % (user_id - 1)
+                self.timed("/login", lambda: self.client.post(
+                    "/login", json={"email": email, "password": BENCH_PASSWORD}
+                ))
+            elif scenario == "add_to_cart":
+                self.log_in_as(user_id)
+                self.timed("/add_to_cart", self.add_items())
+            elif scenario == "checkout":
+                self.log_in_as(user_id)
+                self.add_items()()
+                self.timed("/place_order_from_cart", lambda: self.client.post("/place_order_from_cart"))
+            elif scenario == "my_orders":
+                self.log_in_as(user_id)
+                self.timed("/get-orders1", lambda: self.client.get("/get-orders1"))
+            elif scenario == "owner_orders":
+                self.timed("/get-orders", lambda: self.client.get("/get-orders"))
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def summarise(results, wall_seconds):
+    report = {}
+    for endpoint, bucket in sorted(results.items()):
+        latencies = sorted(bucket["latencies"])
+        report[endpoint] = {
+            "count": len(latencies),
+            "errors": bucket["errors"],
+            "rps": round(len(latencies) / wall_seconds, 2),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        }
+    return report
+
+
+def compare(report, baseline, tolerance):
+    regressions = []
+    for endpoint, current in report.items():
+        before = baseline.get("endpoints", {}).get(endpoint)
+        if not before or not before["p95_ms"]:
+            continue
+        change = (current["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100
+        flag = "REGRESSION" if change > tolerance else ""
+        print("  %-24s p95 %9.2f ms -> %9.2f ms (%+6.1f%%) %s"
+              % (endpoint, before["p95_ms"], current["p95_ms"], change, flag))
+        if flag:
+            regressions.append(endpoint)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test for app.py")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--products", type=int, default=100)
+    parser.add_argument("--cart-rows", type=int, default=2000)
+    parser.add_argument("--orders", type=int, default=20000)
+    parser.add_argument("--requests", type=int, default=2000, help="measured requests in total")
+    parser.add_argument("--warmup", type=int, default=100, help="unmeasured requests before the run")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="weights, e.g. browse=40,login=5,add_to_cart=20")
+    parser.add_argument("--seed", type=int, default=1642)
+    parser.add_argument("--baseline", default=os.path.join(os.path.dirname(__file__), "baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true", help="write the result to --baseline")
+    parser.add_argument("--compare", metavar="PATH", help="compare p95 latencies with a saved run")
+    parser.add_argument("--tolerance", type=float, default=20.0, help="allowed p95 regression in percent")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="pickle-bench-")
+    db_path = os.path.join(workdir, "bench.sqlite3")
+    print("Seeding %s ..." % db_path)
+    seed(db_path, args.users, args.products, args.cart_rows, args.orders, random.Random(args.seed))
+
+    import app as app_module
+
+    app_module.db_pool.dispose()
+    app_module.db_pool.connect = standin_db.connector(db_path)
+    app = app_module.app
+
+    lock = threading.Lock()
+    warmup = {}
+    Worker(app, args, args.mix, args.warmup, args.seed, warmup, lock).run()
+
+    results = {}
+    per_thread = max(1, args.requests // args.threads)
+    workers = [
+        Worker(app, args, args.mix, per_thread, args.seed + n + 1, results, lock)
+        for n in range(args.threads)
+    ]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    wall = time.perf_counter() - started
+
+    report = summarise(results, wall)
+    print("\n%-24s %7s %6s %9s %9s %9s %9s" % ("endpoint", "count", "errors", "rps", "p50 ms", "p95 ms", "p99 ms"))
+    for endpoint, row in report.items():
+        print("%-24s %7d %6d %9.1f %9.2f %9.2f %9.2f" % (
+            endpoint, row["count"], row["errors"], row["rps"], row["p50_ms"], row["p95_ms"], row["p99_ms"]
+        ))
+    print("\n%d requests in %.2fs (%.1f req/s)" % (
+        sum(row["count"] for row in report.values()), wall,
+        sum(row["count"] for row in report.values()) / wall,
+    ))
+
+    result = {
+        "meta": {
+            "python": platform.python_version(),
+            "threads": args.threads,
+            "requests": args.requests,
+            "users": args.users,
+            "products": args.products,
+            "cart_rows": args.cart_rows,
+            "orders": args.orders,
+            "mix": args.mix,
+            "seed": args.seed,
+        },
+        "endpoints": report,
+    }
+
+    status = 0
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print("\nCompared with %s:" % args.compare)
+        if compare(report, baseline, args.tolerance):
+            status = 1
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+        print("Baseline written to %s" % args.baseline)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
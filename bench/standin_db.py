@@ -0,0 +1,230 @@
+import re
+import sqlite3
+import threading
+from decimal import Decimal
+
+
+# ------------------- Stand-in Database -------------------
+#
+# A SQLite file behind the small slice of the mysql.connector API that app.py
+# uses, so the app can be benchmarked with no MySQL server and no network.
+# Statements are translated on the fly (%s placeholders, FOR UPDATE, INSERT
+# IGNORE, ON DUPLICATE KEY UPDATE). Numbers from this backend are only
+# meaningful relative to each other: compare runs against a baseline, not
+# against production.
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name VARCHAR(100) NOT NULL,
+        email VARCHAR(255) NOT NULL UNIQUE,
+        password VARCHAR(255) NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS owners (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name VARCHAR(100),
+        email VARCHAR(255) NOT NULL UNIQUE,
+        password VARCHAR(255) NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name VARCHAR(255) NOT NULL,
+        image_url VARCHAR(1024) NOT NULL,
+        price DECIMAL(10, 2) NOT NULL,
+        stock INTEGER NULL
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_products_name ON products (name)",
+    """
+    CREATE TABLE IF NOT EXISTS cart (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        pickle_name VARCHAR(255) NOT NULL,
+        quantity INTEGER NOT NULL,
+        cost DECIMAL(10, 2) NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_cart_user ON cart (user_id, id)",
+    """
+    CREATE TABLE IF NOT EXISTS orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        pickles VARCHAR(255) NOT NULL,
+        quantity INTEGER NOT NULL,
+        cost DECIMAL(10, 2) NOT NULL,
+        status VARCHAR(32) NOT NULL DEFAULT 'Ordered',
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_orders_user ON orders (user_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status, id)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_created ON orders (created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders (status, created_at)",
+    """
+    CREATE TABLE IF NOT EXISTS orders_archive (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        pickles VARCHAR(255) NOT NULL,
+        quantity INTEGER NOT NULL,
+        cost DECIMAL(10, 2) NOT NULL,
+        status VARCHAR(32) NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_orders_archive_user ON orders_archive (user_id, id)",
+    """
+    CREATE TABLE IF NOT EXISTS sales_daily (
+        day DATE NOT NULL,
+        pickle VARCHAR(255) NOT NULL,
+        status VARCHAR(32) NOT NULL,
+        order_count INTEGER NOT NULL DEFAULT 0,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        revenue DECIMAL(14, 2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, pickle, status)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS catalog_meta (
+        id INTEGER PRIMARY KEY,
+        version INTEGER NOT NULL
+    )
+    """,
+    "INSERT OR IGNORE INTO catalog_meta (id, version) VALUES (1, 0)",
+    """
+    CREATE TABLE IF NOT EXISTS order_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind VARCHAR(32) NOT NULL,
+        payload VARCHAR(1024) NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+]
+
+_TRANSLATIONS = [
+    (re.compile(r"%s"), "?"),
+    (re.compile(r"\s+FOR\s+UPDATE\b", re.I), ""),
+    (re.compile(r"\bINSERT\s+IGNORE\b", re.I), "INSERT OR IGNORE"),
+    (re.compile(r"\bON\s+DUPLICATE\s+KEY\s+UPDATE\b", re.I), "ON CONFLICT DO UPDATE SET"),
+    (re.compile(r"\bVALUES\((\w+)\)", re.I), r"excluded.\1"),
+]
+
+# mysql.connector takes Decimal parameters; so should this.
+sqlite3.register_adapter(Decimal, str)
+
+_translated = {}
+_translated_lock = threading.Lock()
+
+
+def translate(statement):
+    sql = _translated.get(statement)
+    if sql is None:
+        sql = statement
+        for pattern, replacement in _TRANSLATIONS:
+            sql = pattern.sub(replacement, sql)
+        with _translated_lock:
+            _translated[statement] = sql
+    return sql
+
+
+class Cursor:
+    def __init__(self, conn, dictionary=False):
+        self._cursor = conn.cursor()
+        self._dictionary = dictionary
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return {column[0]: value for column, value in zip(self._cursor.description, row)}
+
+    def execute(self, operation, params=None, multi=False):
+        self._cursor.execute(translate(operation), tuple(params or ()))
+
+    def executemany(self, operation, seq_params):
+        self._cursor.executemany(translate(operation), [tuple(p) for p in seq_params])
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchmany(self, size=1):
+        return [self._row(row) for row in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self):
+        self._cursor.close()
+
+
+class Connection:
+    unread_result = False
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._open = True
+
+    def cursor(self, dictionary=False, buffered=None):
+        return Cursor(self._conn, dictionary)
+
+    @property
+    def in_transaction(self):
+        return self._conn.in_transaction
+
+    def start_transaction(self, **kwargs):
+        if not self._conn.in_transaction:
+            self._conn.execute("BEGIN")
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def consume_results(self):
+        pass
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        if not self._open:
+            raise sqlite3.ProgrammingError("Connection closed")
+
+    def is_connected(self):
+        return self._open
+
+    def close(self):
+        self._open = False
+        self._conn.close()
+
+
+def create(path):
+    conn = sqlite3.connect(path)
+    for statement in SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    conn.close()
+
+
+def connector(path):
+    # A connect() callable for db_pool.ConnectionPool.
+    return lambda: Connection(path)
@@ -0,0 +1,241 @@
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+
+
+# ------------------- Cart Store -------------------
+#
+# Carts are kept in memory per user (session["user_id"]) and served from
+# there. Adding a pickle that is already in the cart grows that line instead
+# of adding a row.
+#
+# The cart table stays the source of truth: every add and remove is written
+# to it before returning, since the next request (a checkout, say) may land
+# on another process. Writes are deltas (add n to a line, drop a line), so
+# writes from several processes merge in the table instead of overwriting
+# each other, and an entry is reloaded after `ttl` seconds so a cart changed
+# through another process is not shown stale for long. With max_users=0
+# nothing is kept: every read loads.
+
+LOAD_SQL = "SELECT id, pickle_name, quantity, cost FROM cart WHERE user_id = %s ORDER BY id"
+# Filled with one placeholder per removed id / one row per changed line.
+DELETE_SQL = "DELETE FROM cart WHERE user_id = %%s AND id IN (%s)"
+WRITE_SQL = (
+    "INSERT INTO cart (id, user_id, pickle_name, quantity, cost) VALUES %s "
+    "ON DUPLICATE KEY UPDATE quantity = quantity + VALUES(quantity), cost = cost + VALUES(cost)"
+)
+WRITE_ROW = "(%s, %s, %s, %s, %s)"
+
+
+class CartStoreError(Exception):
+    pass
+
+
+class CartLine:
+    def __init__(self, pickle_name):
+        self.pickle_name = pickle_name
+        self.ids = []                 # cart rows holding this line
+        self.quantity = 0             # as stored in those rows
+        self.cost = Decimal(0)
+        self.pending_quantity = 0     # added here, being written
+        self.pending_cost = Decimal(0)
+
+    def as_dict(self, user_id):
+        return {
+            "id": self.ids[0] if self.ids else None,
+            "user_id": user_id,
+            "pickle_name": self.pickle_name,
+            "quantity": self.quantity + self.pending_quantity,
+            "cost": self.cost + self.pending_cost,
+        }
+
+
+class CartEntry:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.lock = threading.RLock()
+        self.lines = OrderedDict()    # pickle_name -> CartLine
+        self.removed_ids = set()
+        self.loaded_at = None         # None: must (re)load before reading
+
+    def forget(self):
+        # A write failed: drop what is kept so nothing unwritten is shown
+        # or written later, and reload on the next use.
+        self.lines = OrderedDict()
+        self.removed_ids = set()
+        self.loaded_at = None
+
+
+def cart_lines(rows):
+    # (id, pickle_name, quantity, cost) rows in id order -> {pickle_name:
+    # CartLine}, one line per pickle however many rows it is spread over.
+    lines = OrderedDict()
+    for row_id, pickle_name, quantity, cost in rows:
+        line = lines.get(pickle_name)
+        if line is None:
+            line = lines[pickle_name] = CartLine(pickle_name)
+        line.ids.append(row_id)
+        line.quantity += quantity
+        line.cost += cost
+    return lines
+
+
+class CartStore:
+    def __init__(self, get_connection, max_users=10000, ttl=5.0):
+        self._get_connection = get_connection
+        self.max_users = max_users
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # user_id -> CartEntry, oldest first
+        self._stats = {"hits": 0, "loads": 0, "flushes": 0, "rows_written": 0, "evictions": 0}
+
+    # ---- public API ----
+
+    def lines(self, user_id):
+        entry = self._entry(user_id)
+        with entry.lock:
+            if not self._refresh(entry):
+                self._count("hits")
+            return [line.as_dict(user_id) for line in entry.lines.values()]
+
+    def add(self, user_id, items):
+        # items: (pickle_name, quantity, cost) with cost the line total.
+        entry = self._entry(user_id)
+        with entry.lock:
+            if self.max_users:
+                # Loaded first so a pickle already in the table is merged
+                # into its row rather than inserted again.
+                self._refresh(entry)
+            for pickle_name, quantity, cost in items:
+                line = entry.lines.get(pickle_name)
+                if line is None:
+                    line = entry.lines[pickle_name] = CartLine(pickle_name)
+                line.pending_quantity += quantity
+                line.pending_cost += cost
+            self._flush(entry)
+
+    def remove(self, user_id, pickle_name=None, row_id=None):
+        # Drops a whole line, named by pickle or by one of its cart row ids.
+        # Returns False when the cart has no such line.
+        entry = self._entry(user_id)
+        with entry.lock:
+            self._refresh(entry)
+            if pickle_name is None:
+                pickle_name = next((line.pickle_name for line in entry.lines.values() if row_id in line.ids), None)
+            line = entry.lines.pop(pickle_name, None)
+            if line is None:
+                return False
+            entry.removed_ids.update(line.ids)
+            self._flush(entry)
+            return True
+
+    def invalidate(self, user_id):
+        # The cart table changed behind the store (checkout): reload on the
+        # next read.
+        with self._lock:
+            entry = self._entries.get(user_id)
+        if entry is not None:
+            with entry.lock:
+                entry.loaded_at = None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["users"] = len(self._entries)
+        stats["max_users"] = self.max_users
+        return stats
+
+    # ---- internals ----
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def _entry(self, user_id):
+        if not self.max_users:
+            return CartEntry(user_id)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                entry = self._entries[user_id] = CartEntry(user_id)
+                while len(self._entries) > self.max_users:
+                    self._entries.popitem(last=False)
+                    self._stats["evictions"] += 1
+            else:
+                self._entries.move_to_end(user_id)
+        return entry
+
+    def _refresh(self, entry):
+        # (Re)loads a cold or expired entry. Caller holds entry.lock.
+        if entry.loaded_at is not None and time.monotonic() - entry.loaded_at <= self.ttl:
+            return False
+        self._load(entry)
+        return True
+
+    def _load(self, entry):
+        conn = self._get_connection()
+        if not conn:
+            raise CartStoreError("Database connection error")
+        with conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(LOAD_SQL, (entry.user_id,))
+                rows = cursor.fetchall()
+            finally:
+                cursor.close()
+
+        entry.lines = cart_lines(rows)
+        entry.loaded_at = time.monotonic()
+        self._count("loads")
+
+    def _flush(self, entry):
+        # Writes the entry's changes to the cart table. Caller holds
+        # entry.lock.
+        changed = [line for line in entry.lines.values() if line.pending_quantity or line.pending_cost]
+        removed = sorted(entry.removed_ids)
+        if not changed and not removed:
+            return
+
+        conn = self._get_connection()
+        if not conn:
+            entry.forget()
+            raise CartStoreError("Database connection error")
+        with conn:
+            cursor = conn.cursor()
+            try:
+                conn.start_transaction()
+                if removed:
+                    cursor.execute(DELETE_SQL % ", ".join(["%s"] * len(removed)), [entry.user_id] + removed)
+                if changed:
+                    # One statement for every line: a line with a row grows
+                    # it, a new line (id NULL) gets one.
+                    cursor.execute(
+                        WRITE_SQL % ", ".join([WRITE_ROW] * len(changed)),
+                        [value for line in changed for value in (
+                            line.ids[0] if line.ids else None, entry.user_id,
+                            line.pickle_name, line.pending_quantity, line.pending_cost,
+                        )],
+                    )
+                    # MySQL counts 2 per grown row and 1 per inserted one.
+                    all_grown = cursor.rowcount == 2 * len(changed)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                entry.forget()
+                raise
+            finally:
+                cursor.close()
+
+        entry.removed_ids.difference_update(removed)
+        for line in changed:
+            line.quantity += line.pending_quantity
+            line.cost += line.pending_cost
+            line.pending_quantity, line.pending_cost = 0, Decimal(0)
+        if changed and not all_grown:
+            # New rows, or rows that went with a checkout elsewhere and were
+            # put back: reload for their ids and quantities.
+            entry.loaded_at = None
+        with self._lock:
+            self._stats["flushes"] += 1
+            self._stats["rows_written"] += len(removed) + len(changed)
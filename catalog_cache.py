@@ -0,0 +1,90 @@
+import threading
+
+
+# ------------------- Product Catalog Cache -------------------
+#
+# The product list is cached in-process and keyed by a version counter kept
+# in the database (catalog_meta). Every reader does a one-row primary key
+# lookup of that counter; /insert-product and /delete-product bump it inside
+# their own transaction, so all worker processes notice the change on their
+# next request without any TTL. Migration 1 creates and seeds catalog_meta.
+
+# Not stock: it changes with every sale and would go stale here.
+PRODUCTS_SQL = "SELECT id, name, image_url, price FROM products ORDER BY id"
+
+
+class CatalogMetaMissing(Exception):
+    pass
+
+
+class CatalogCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._products = None
+        self._derived = {}
+
+    def current_version(self, cursor):
+        cursor.execute("SELECT version FROM catalog_meta WHERE id = 1")
+        row = cursor.fetchone()
+        if row is None:
+            return 0
+        return row["version"] if isinstance(row, dict) else row[0]
+
+    def bump_version(self, cursor):
+        # Call before the product write so both commit together. Without
+        # the row no reader would ever see the change, so the write fails.
+        cursor.execute("UPDATE catalog_meta SET version = version + 1 WHERE id = 1")
+        if cursor.rowcount != 1:
+            raise CatalogMetaMissing("catalog_meta has no row 1; run migrations.py upgrade")
+
+    def get_products(self, conn):
+        # Returns (version, products ordered by id). Only the version lookup
+        # touches the database while the cache is warm.
+        cursor = conn.cursor(dictionary=True)
+        try:
+            version = self.current_version(cursor)
+            with self._lock:
+                if self._version == version:
+                    return version, self._products
+
+            cursor.execute(PRODUCTS_SQL)
+            products = cursor.fetchall()
+        finally:
+            cursor.close()
+
+        self.store(version, products)
+        return version, products
+
+    def store(self, version, products):
+        # For readers that fetch the list themselves (asgi_app.py).
+        with self._lock:
+            if self._version is None or version >= self._version:
+                self._version = version
+                self._products = products
+                self._derived = {}
+
+    def last(self):
+        # The cached (version, products), or None before the first load.
+        with self._lock:
+            if self._version is None:
+                return None
+            return self._version, self._products
+
+    def derived(self, version, key, build):
+        # Memoise something computed from the product list (a JSON body, a
+        # rendered page) for as long as the catalog version stays the same.
+        with self._lock:
+            if self._version == version and key in self._derived:
+                return self._derived[key]
+        value = build()
+        with self._lock:
+            if self._version == version:
+                self._derived[key] = value
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._version = None
+            self._products = None
+            self._derived = {}
@@ -0,0 +1,521 @@
+import threading
+import time
+from collections import deque
+
+
+# ------------------- Connection Pool -------------------
+#
+# A small thread-safe pool around any DB-API style connect() callable.
+# Connections beyond `size` are "overflow" connections: they are created
+# when the pool is busy and closed as soon as they are returned.
+#
+# ReplicaSet spreads reads over several read-only pools (round-robin) and
+# skips a replica for `retry_after` seconds once it fails to hand out a
+# connection.
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class DatabaseUnavailable(Exception):
+    # Raised without trying the database while the circuit breaker is open.
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    # Opens after `failure_threshold` connect failures in a row; while open,
+    # acquire() fails at once instead of waiting on a dead server. After
+    # `reset_timeout` seconds one trial connect is let through: success
+    # closes the breaker, failure opens it again.
+    def __init__(self, failure_threshold=5, reset_timeout=10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial = False
+        self._opens = 0
+        self._rejected = 0
+
+    def before(self):
+        if self._state == "closed":
+            return
+        with self._lock:
+            if self._state == "open":
+                remaining = self._opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    self._rejected += 1
+                    raise DatabaseUnavailable("Database unavailable", retry_after=max(1, int(remaining + 0.999)))
+                self._state = "half-open"
+            if self._state == "half-open":
+                if self._trial:
+                    self._rejected += 1
+                    raise DatabaseUnavailable("Database unavailable", retry_after=1)
+                self._trial = True
+
+    def success(self):
+        if self._state == "closed" and not self._failures:
+            return
+        with self._lock:
+            self._state = "closed"
+            self._failures = 0
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial = False
+            if self._state == "half-open" or self._failures >= self.failure_threshold:
+                if self._state != "open":
+                    self._opens += 1
+                self._state = "open"
+                self._opened_at = time.monotonic()
+
+    def abandon(self):
+        # A trial checkout ended without telling us anything (pool timeout).
+        with self._lock:
+            self._trial = False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "open": int(self._state != "closed"),
+                "consecutive_failures": self._failures,
+                "opens": self._opens,
+                "rejected": self._rejected,
+            }
+
+
+class ObservedCursor:
+    # Times execute/fetch calls and reports each one to
+    # observer(statement, seconds). statement_observer(statement, params,
+    # seconds) gets one call per executed statement, with the execute and
+    # fetch time added up, once its rows are read or the cursor moves on.
+    def __init__(self, cursor, observer, statement_observer=None):
+        self._cursor = cursor
+        self._observer = observer
+        self._statement_observer = statement_observer
+        self._statement = None
+        self._params = None
+        self._elapsed = None
+
+    def _timed(self, statement, call, *args):
+        started = time.perf_counter()
+        try:
+            return call(*args)
+        finally:
+            seconds = time.perf_counter() - started
+            if self._observer:
+                self._observer(statement, seconds)
+            if self._elapsed is not None:
+                self._elapsed += seconds
+
+    def _finish(self):
+        if self._elapsed is not None:
+            elapsed, self._elapsed = self._elapsed, None
+            if self._statement_observer:
+                self._statement_observer(self._statement, self._params, elapsed)
+
+    def _start(self, operation, params):
+        self._finish()
+        self._statement, self._params = operation, params
+        self._elapsed = 0.0
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        self._start(operation, params)
+        return self._timed(operation, lambda: self._cursor.execute(operation, params, *args, **kwargs))
+
+    def executemany(self, operation, seq_params):
+        self._start(operation, None)
+        return self._timed(operation, self._cursor.executemany, operation, seq_params)
+
+    def fetchone(self):
+        row = self._timed(self._statement, self._cursor.fetchone)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size=1):
+        rows = self._timed(self._statement, self._cursor.fetchmany, size)
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(self._statement, self._cursor.fetchall)
+        self._finish()
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def close(self):
+        self._finish()
+        return self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class PooledConnection:
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self._returned = False
+
+    @property
+    def raw(self):
+        return self._raw
+
+    @property
+    def read_only(self):
+        return self._pool.read_only
+
+    def cursor(self, *args, **kwargs):
+        cursor = self._raw.cursor(*args, **kwargs)
+        observer = self._pool.query_observer
+        statement_observer = self._pool.statement_observer
+        if observer or statement_observer:
+            return ObservedCursor(cursor, observer, statement_observer)
+        return cursor
+
+    def close(self):
+        # Hand the connection back instead of tearing down the socket.
+        if not self._returned:
+            self._returned = True
+            self._pool.release(self._raw)
+
+    def discard(self):
+        # Instead of close() when a result was left part-read (the client of
+        # a stream went away): drops the connection rather than reading the
+        # rest of the rows to make it reusable.
+        if not self._returned:
+            self._returned = True
+            self._pool.abandon(self._raw)
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ConnectionPool:
+    def __init__(self, connect, size=5, max_overflow=5, max_lifetime=1800,
+                 pre_ping=True, acquire_timeout=5.0, read_only=False, name=None, breaker=None):
+        # Zero-argument callable returning a new DB-API connection.
+        self.connect = connect
+        self.breaker = breaker
+        self.read_only = read_only
+        self.name = name
+        self.size = size
+        self.max_overflow = max_overflow
+        self.max_lifetime = max_lifetime
+        self.pre_ping = pre_ping
+        self.acquire_timeout = acquire_timeout
+        # Optional observer(statement, seconds) called for every cursor call,
+        # and statement_observer(statement, params, seconds) once per
+        # executed statement (see ObservedCursor).
+        self.query_observer = None
+        self.statement_observer = None
+
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._idle = deque()
+        self._born = {}
+        self._open = 0
+        self._in_use = 0
+
+        self._stats = {
+            "checkouts": 0,
+            "connects": 0,
+            "recycled": 0,
+            "failed_pings": 0,
+            "exhausted": 0,
+            "waits": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+        }
+
+    # ---- checkout / checkin ----
+
+    def acquire(self, timeout=None):
+        if self.breaker is None:
+            return self._acquire(timeout)
+        self.breaker.before()
+        try:
+            conn = self._acquire(timeout)
+        except BaseException:
+            self.breaker.abandon()
+            raise
+        self.breaker.success()
+        return conn
+
+    def _acquire(self, timeout=None):
+        timeout = self.acquire_timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = False
+
+        while True:
+            with self._lock:
+                raw = None
+                while raw is None:
+                    if self._idle:
+                        raw = self._idle.pop()
+                        break
+                    if self._open < self.size + self.max_overflow:
+                        # Reserve a slot, connect outside the lock.
+                        self._open += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["exhausted"] += 1
+                        raise PoolTimeout(
+                            "No database connection available after %.1fs" % timeout
+                        )
+                    waited = True
+                    self._available.wait(remaining)
+
+            if raw is None:
+                try:
+                    raw = self.connect()
+                except Exception:
+                    with self._lock:
+                        self._open -= 1
+                        self._available.notify()
+                    if self.breaker is not None:
+                        self.breaker.failure()
+                    raise
+                with self._lock:
+                    self._born[id(raw)] = time.monotonic()
+                    self._stats["connects"] += 1
+            elif not self._usable(raw):
+                self._discard(raw)
+                continue
+
+            with self._lock:
+                self._in_use += 1
+                self._stats["checkouts"] += 1
+                if waited:
+                    wait = time.monotonic() - started
+                    self._stats["waits"] += 1
+                    self._stats["wait_seconds_total"] += wait
+                    self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], wait)
+            return PooledConnection(self, raw)
+
+    def release(self, raw):
+        try:
+            # Leave nothing behind for the next borrower.
+            if getattr(raw, "unread_result", False):
+                raw.consume_results()
+            if getattr(raw, "in_transaction", False):
+                raw.rollback()
+        except Exception:
+            with self._lock:
+                self._in_use -= 1
+            self._discard(raw)
+            return
+
+        with self._lock:
+            self._in_use -= 1
+            keep = len(self._idle) < self.size and not self._expired(raw)
+            if keep:
+                self._idle.append(raw)
+                self._available.notify()
+                return
+        self._discard(raw)
+
+    def abandon(self, raw):
+        with self._lock:
+            self._in_use -= 1
+        try:
+            # Closes the socket without a QUIT, and without reading on.
+            raw.shutdown()
+        except NotImplementedError:
+            # The C extension has no shutdown() and reads the rest of an
+            # unbuffered result on close: stop the statement first.
+            self._kill_query(raw)
+        except Exception:
+            pass
+        self._discard(raw)
+
+    def _kill_query(self, raw):
+        # On a connection of its own, outside the pool's limits and breaker:
+        # streams are abandoned when the pool is busiest, and waiting for a
+        # pooled connection here would only hold up the request thread.
+        try:
+            conn = self.connect()
+        except Exception as e:
+            print("Error stopping abandoned query %s: cannot connect:" % raw.connection_id, e)
+            return
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("KILL QUERY %s", (raw.connection_id,))
+            finally:
+                cursor.close()
+        except Exception as e:
+            print("Error stopping abandoned query %s:" % raw.connection_id, e)
+        finally:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def connection(self, timeout=None):
+        # `with pool.connection() as conn:` returns the connection on exit.
+        return self.acquire(timeout)
+
+    # ---- housekeeping ----
+
+    def prefill(self, count=None):
+        count = self.size if count is None else min(count, self.size)
+        conns = []
+        try:
+            while len(conns) < count:
+                conns.append(self.acquire())
+        finally:
+            for conn in conns:
+                conn.close()
+        return len(conns)
+
+    def dispose(self):
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for raw in idle:
+            self._discard(raw)
+
+    def reset_after_fork(self):
+        # Sockets inherited from a parent process must never be reused.
+        with self._lock:
+            self._idle.clear()
+            self._born.clear()
+            self._open = 0
+            self._in_use = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                "breaker_open": self.breaker.stats()["open"] if self.breaker else 0,
+                "size": self.size,
+                "max_overflow": self.max_overflow,
+                "open": self._open,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+            })
+        return stats
+
+    def _expired(self, raw):
+        born = self._born.get(id(raw))
+        return born is not None and self.max_lifetime and time.monotonic() - born > self.max_lifetime
+
+    def _usable(self, raw):
+        with self._lock:
+            expired = self._expired(raw)
+        if expired:
+            with self._lock:
+                self._stats["recycled"] += 1
+            return False
+        if not self.pre_ping:
+            return True
+        try:
+            raw.ping(reconnect=False)
+            return True
+        except Exception:
+            with self._lock:
+                self._stats["failed_pings"] += 1
+            return False
+
+    def _discard(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._born.pop(id(raw), None)
+            self._open -= 1
+            self._available.notify()
+
+
+class ReplicaSet:
+    def __init__(self, pools, retry_after=30.0):
+        self.pools = list(pools)
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._next = 0
+        self._down_until = [0.0] * len(self.pools)
+        self._stats = {"checkouts": 0, "failovers": 0, "busy": 0}
+
+    def __bool__(self):
+        return bool(self.pools)
+
+    def acquire(self):
+        # A connection from the next healthy replica, or None when every
+        # replica is down (the caller then reads from the writer).
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self.pools) if self.pools else 0
+        now = time.monotonic()
+        for offset in range(len(self.pools)):
+            index = (start + offset) % len(self.pools)
+            if self._down_until[index] > now:
+                continue
+            try:
+                conn = self.pools[index].acquire()
+            except (PoolTimeout, DatabaseUnavailable):
+                # Busy, or its breaker already keeps callers off: not a
+                # reason to stop using it. Try the next one.
+                with self._lock:
+                    self._stats["busy"] += 1
+                continue
+            except Exception as e:
+                # Connecting or pinging failed.
+                print("Error connecting to read replica %s:" % self.pools[index].name, e)
+                with self._lock:
+                    self._down_until[index] = time.monotonic() + self.retry_after
+                    self._stats["failovers"] += 1
+                continue
+            with self._lock:
+                self._stats["checkouts"] += 1
+            return conn
+        return None
+
+    def prefill(self, count=None):
+        return sum(pool.prefill(count) for pool in self.pools)
+
+    def dispose(self):
+        for pool in self.pools:
+            pool.dispose()
+
+    def reset_after_fork(self):
+        for pool in self.pools:
+            pool.reset_after_fork()
+        with self._lock:
+            self._down_until = [0.0] * len(self.pools)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            stats = dict(self._stats)
+            stats["replicas"] = len(self.pools)
+            stats["down"] = sum(1 for until in self._down_until if until > now)
+        for pool in self.pools:
+            pool_stats = pool.stats()
+            for key in ("open", "idle", "in_use"):
+                stats[key] = stats.get(key, 0) + pool_stats[key]
+        return stats
@@ -0,0 +1,114 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+
+# ------------------- Password Hashing Pool -------------------
+#
+# PBKDF2/scrypt are CPU-bound on purpose. Running them on the request thread
+# holds the GIL for the whole hash, so a burst of logins stalls every other
+# request in the worker. PasswordHasher sends them to a small process pool
+# instead, and admits only `max_pending` hashes at once so a login flood is
+# turned away with HashingBusy rather than queueing without bound.
+
+
+class HashingBusy(Exception):
+    pass
+
+
+def hash_prefix(method):
+    # The method string werkzeug stores in front of the salt, with its
+    # defaults filled in: "pbkdf2" -> "pbkdf2:sha256:600000".
+    name, *args = method.split(":")
+    if name == "pbkdf2":
+        digest = args[0] if args else "sha256"
+        iterations = args[1] if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return "pbkdf2:%s:%s" % (digest, iterations)
+    if name == "scrypt":
+        n, r, p = (args + ["32768", "8", "1"][len(args):])[:3]
+        return "scrypt:%s:%s:%s" % (n, r, p)
+    return method
+
+
+def _timed_call(fn, args, submitted):
+    # Runs in the pool process; reports how long the job sat in the queue.
+    started = time.time()
+    return fn(*args), started - submitted
+
+
+class PasswordHasher:
+    def __init__(self, method="pbkdf2:sha256:600000", salt_length=16, workers=2,
+                 max_pending=32, admission_timeout=1.0):
+        self.method = method
+        self.salt_length = salt_length
+        self.workers = workers
+        self.admission_timeout = admission_timeout
+        self._admission = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+        self._prefix = hash_prefix(method)
+        self._stats = {
+            "jobs": 0,
+            "rejected": 0,
+            "in_flight": 0,
+            "queue_seconds_total": 0.0,
+            "queue_seconds_max": 0.0,
+        }
+
+    def _pool(self):
+        # Created on first use and again after a fork, never inherited.
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _run(self, fn, *args):
+        if not self._admission.acquire(timeout=self.admission_timeout):
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise HashingBusy("Too many password hashes in progress")
+        with self._lock:
+            self._stats["in_flight"] += 1
+        try:
+            if self.workers <= 0:
+                result, queued = _timed_call(fn, args, time.time())
+            else:
+                result, queued = self._pool().submit(_timed_call, fn, args, time.time()).result()
+        finally:
+            self._admission.release()
+            with self._lock:
+                self._stats["in_flight"] -= 1
+        with self._lock:
+            self._stats["jobs"] += 1
+            self._stats["queue_seconds_total"] += queued
+            self._stats["queue_seconds_max"] = max(self._stats["queue_seconds_max"], queued)
+        return result
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, stored_hash, password):
+        return self._run(check_password_hash, stored_hash, password)
+
+    def needs_rehash(self, stored_hash):
+        # True when the stored hash was made with other parameters.
+        return stored_hash.split("$", 1)[0] != self._prefix
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None and self._executor_pid == os.getpid():
+            executor.shutdown(wait=False, cancel_futures=True)
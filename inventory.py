@@ -0,0 +1,89 @@
+# ------------------- Inventory -------------------
+#
+# products.stock is the number of units left; NULL means the product is not
+# stock-tracked and always sells. Checkout takes stock inside the order
+# transaction with a fixed number of statements however long the cart is:
+# one SELECT ... FOR UPDATE finds the tracked products among the pickles,
+# flags those short of stock and locks them (in name order, the order of
+# the unique index, so two carts never lock the same products in opposite
+# order), then one conditional UPDATE takes every pickle's quantity at
+# once. Two buyers of the last jar cannot both get it. The locks are held
+# until commit, so callers take stock as the last step before committing.
+# products.name is unique (migration 7), so a name is one product and one
+# stock count.
+
+# Filled with "WHEN %s THEN %s" per pickle and a placeholder per name. The
+# database matches names by its collation ("mango pickle" is "Mango
+# Pickle"), so rows are never looked up by name here.
+TRACKED_SQL = """
+    SELECT name, stock < CASE name %s END FROM products
+    WHERE name IN (%s) AND stock IS NOT NULL ORDER BY name FOR UPDATE
+"""
+TAKE_SQL = """
+    UPDATE products SET stock = stock - CASE name %s END
+    WHERE name IN (%s) AND stock IS NOT NULL AND stock >= CASE name %s END
+"""
+RELEASE_SQL = "UPDATE products SET stock = stock + CASE name %s END WHERE name IN (%s) AND stock IS NOT NULL"
+
+
+class OutOfStock(Exception):
+    def __init__(self, pickle):
+        super().__init__("Not enough stock for %s" % pickle)
+        self.pickle = pickle
+
+
+def totals(items):
+    # (pickle, quantity) pairs -> {pickle: total quantity}
+    wanted = {}
+    for pickle, quantity in items:
+        wanted[pickle] = wanted.get(pickle, 0) + int(quantity)
+    return wanted
+
+
+def tracked_query(wanted):
+    # {pickle: quantity} -> (statement, params)
+    whens = " ".join(["WHEN %s THEN %s"] * len(wanted))
+    cases = [value for item in sorted(wanted.items()) for value in item]
+    names = sorted(wanted)
+    return TRACKED_SQL % (whens, ", ".join(["%s"] * len(names))), cases + names
+
+
+def take_query(wanted):
+    whens = " ".join(["WHEN %s THEN %s"] * len(wanted))
+    cases = [value for item in sorted(wanted.items()) for value in item]
+    names = sorted(wanted)
+    return TAKE_SQL % (whens, ", ".join(["%s"] * len(names)), whens), cases + names + cases
+
+
+def release_query(wanted):
+    whens = " ".join(["WHEN %s THEN %s"] * len(wanted))
+    names = sorted(wanted)
+    return RELEASE_SQL % (whens, ", ".join(["%s"] * len(names))), [
+        value for item in sorted(wanted.items()) for value in item] + names
+
+
+def take(cursor, items):
+    # Raises OutOfStock when a tracked pickle has too few units left; the
+    # caller rolls back.
+    wanted = {pickle: quantity for pickle, quantity in totals(items).items() if quantity > 0}
+    if not wanted:
+        return
+    cursor.execute(*tracked_query(wanted))
+    tracked = cursor.fetchall()
+    for name, short in tracked:
+        if short:
+            raise OutOfStock(name)
+    if not tracked:
+        return
+    # Untracked pickles are left alone by its stock IS NOT NULL.
+    cursor.execute(*take_query(wanted))
+    if cursor.rowcount != len(tracked):
+        # Only if the locked rows changed anyway; never take part of a cart.
+        raise OutOfStock(", ".join(name for name, _ in tracked))
+
+
+def release(cursor, items):
+    # Puts units back, e.g. for a cancelled order.
+    wanted = {pickle: quantity for pickle, quantity in totals(items).items() if quantity > 0}
+    if wanted:
+        cursor.execute(*release_query(wanted))
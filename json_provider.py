@@ -0,0 +1,72 @@
+import json
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional; the stdlib encoder is used instead
+    orjson = None
+
+
+# ------------------- JSON Provider -------------------
+#
+# FastJSONProvider encodes with orjson when it is installed and with the
+# stdlib json module otherwise. Output matches Flask's own provider either
+# way: Decimal as a string, dates as HTTP dates, sorted keys, compact unless
+# the app is in debug mode. json_array() streams a list straight from a
+# cursor instead of building it in memory first.
+
+STREAM_BATCH = 500
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    if orjson is not None:
+        # Dates go through default() too, so they keep Flask's format.
+        _options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS
+
+    def _pretty(self):
+        return self.compact is False or (self.compact is None and self._app.debug)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs or not self.sort_keys or self._pretty():
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._options).decode()
+
+    def dump_bytes(self, obj):
+        # The encoded bytes as they go on the wire, formatted the way
+        # DefaultJSONProvider.response() formats them.
+        if orjson is None or not self.sort_keys or self._pretty():
+            if self._pretty():
+                text = super().dumps(obj, indent=2)
+            else:
+                text = super().dumps(obj, separators=(",", ":"))
+            return (text + "\n").encode()
+        return orjson.dumps(obj, default=self.default, option=self._options | orjson.OPT_APPEND_NEWLINE)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dump_bytes(obj), mimetype=self.mimetype)
+
+    def json_array(self, head, key, rows, tail=None):
+        # Yields `{...head, key: [rows...], ...tail}` as text chunks, encoding
+        # STREAM_BATCH rows at a time. `rows` is any iterable of dicts, e.g.
+        # an unbuffered cursor.
+        prefix = self._compact(head)[:-1]
+        yield "%s%s%s:[" % (prefix, "," if head else "", json.dumps(key))
+        batch = []
+        first = True
+        for row in rows:
+            batch.append(self._compact(row))
+            if len(batch) >= STREAM_BATCH:
+                yield ("" if first else ",") + ",".join(batch)
+                first = False
+                batch = []
+        if batch:
+            yield ("" if first else ",") + ",".join(batch)
+        suffix = self._compact(tail or {})[1:]
+        yield "]%s%s\n" % ("," if tail else "", suffix)
+
+    def _compact(self, obj):
+        if orjson is None:
+            return super().dumps(obj, separators=(",", ":"))
+        return orjson.dumps(obj, default=self.default, option=self._options).decode()
@@ -0,0 +1,156 @@
+import threading
+import time
+from bisect import bisect_left
+
+from flask import g, request
+
+
+# ------------------- Request Metrics -------------------
+#
+# Per-endpoint latency histograms, status counts, in-flight requests and the
+# time each request spends in the database, in password hashing and in JSON
+# serialisation. Everything is kept in this process and rendered in the
+# Prometheus text format by render(). Recording is a dict lookup, a bisect and
+# a few additions under one lock, so it can stay on in production.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PHASES = ("db", "hash", "serialize")
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def copy(self):
+        other = Histogram(self.buckets)
+        other.counts, other.sum, other.count = self.counts[:], self.sum, self.count
+        return other
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, cumulative))
+        lines.append('%s_bucket{%s,le="+Inf"} %d' % (name, labels, self.count))
+        lines.append("%s_sum{%s} %.6f" % (name, labels, self.sum))
+        lines.append("%s_count{%s} %d" % (name, labels, self.count))
+        return lines
+
+
+def add_phase_time(phase, seconds):
+    # Attribute time to a phase of the current request; no-op outside one.
+    try:
+        phases = g.metric_phases
+    except (AttributeError, RuntimeError):
+        return
+    phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+class timed_phase:
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, exc_type, exc, tb):
+        add_phase_time(self.phase, time.perf_counter() - self.started)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._phases = {}
+        self._statuses = {}
+        self._in_flight = 0
+        self._gauges = []
+
+    def init_app(self, app):
+        app.before_request(self._before)
+        app.after_request(self._after)
+        app.teardown_request(self._teardown)
+
+    def add_gauges(self, name, collect):
+        # collect() -> {metric: value}, rendered as name_metric gauges.
+        self._gauges.append((name, collect))
+
+    def _before(self):
+        g.metric_started = time.perf_counter()
+        g.metric_phases = {}
+        g.metric_status = 500
+        with self._lock:
+            self._in_flight += 1
+
+    def _after(self, response):
+        g.metric_status = response.status_code
+        return response
+
+    def _teardown(self, exc):
+        started = g.pop("metric_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or "unmatched"
+        status = g.pop("metric_status", 500)
+        phases = g.pop("metric_phases", {})
+        self.record(endpoint, request.method, status, elapsed, phases)
+
+    def record(self, endpoint, method, status, elapsed, phases):
+        with self._lock:
+            self._in_flight -= 1
+            histogram = self._latency.get(endpoint)
+            if histogram is None:
+                histogram = self._latency[endpoint] = Histogram()
+            histogram.observe(elapsed)
+            key = (endpoint, method, status)
+            self._statuses[key] = self._statuses.get(key, 0) + 1
+            for phase, seconds in phases.items():
+                key = (endpoint, phase)
+                self._phases[key] = self._phases.get(key, 0.0) + seconds
+
+    def render(self):
+        with self._lock:
+            latency = {endpoint: histogram.copy() for endpoint, histogram in self._latency.items()}
+            statuses = dict(self._statuses)
+            phases = dict(self._phases)
+            in_flight = self._in_flight
+
+        lines = [
+            "# HELP http_request_duration_seconds Request latency by endpoint.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for endpoint in sorted(latency):
+            lines.extend(latency[endpoint].render("http_request_duration_seconds", 'endpoint="%s"' % endpoint))
+
+        lines.append("# HELP http_requests_total Requests by endpoint, method and status.")
+        lines.append("# TYPE http_requests_total counter")
+        for (endpoint, method, status), count in sorted(statuses.items()):
+            lines.append('http_requests_total{endpoint="%s",method="%s",status="%s"} %d'
+                         % (endpoint, method, status, count))
+
+        lines.append("# HELP http_request_phase_seconds_total Time spent per phase (%s)." % ", ".join(PHASES))
+        lines.append("# TYPE http_request_phase_seconds_total counter")
+        for (endpoint, phase), seconds in sorted(phases.items()):
+            lines.append('http_request_phase_seconds_total{endpoint="%s",phase="%s"} %.6f'
+                         % (endpoint, phase, seconds))
+
+        lines.append("# HELP http_requests_in_flight Requests currently being served.")
+        lines.append("# TYPE http_requests_in_flight gauge")
+        lines.append("http_requests_in_flight %d" % in_flight)
+
+        for name, collect in self._gauges:
+            for metric, value in sorted(collect().items()):
+                if isinstance(value, (int, float)):
+                    lines.append("# TYPE %s_%s gauge" % (name, metric))
+                    lines.append("%s_%s %s" % (name, metric, value))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,388 @@
+import argparse
+import os
+import sys
+
+import mysql.connector
+from dotenv import load_dotenv
+
+import cart_store
+import inventory
+import order_export
+import sales
+
+
+# ------------------- Schema Migrations -------------------
+#
+#   python migrations.py upgrade      apply pending migrations
+#   python migrations.py status       list applied / pending migrations
+#   python migrations.py check        EXPLAIN every query app.py issues and
+#                                     exit non-zero if one scans a whole table
+#
+# Every step is idempotent (CREATE ... IF NOT EXISTS, indexes only added when
+# missing) so the first upgrade is safe on databases that were set up by hand.
+
+
+def connect():
+    load_dotenv()
+    return mysql.connector.connect(
+        host=os.getenv("DB_HOST"),
+        user=os.getenv("DB_USER"),
+        port=os.getenv("DB_PORT"),
+        password=os.getenv("DB_PASSWORD"),
+        database=os.getenv("DB_NAME"),
+        auth_plugin='mysql_native_password'
+    )
+
+
+def add_index(name, table, columns, unique=False):
+    # Skip when any index on `table` already leads with `columns`; for a
+    # unique one, when a unique index on exactly `columns` exists.
+    def step(cursor):
+        cursor.execute("""
+            SELECT index_name, MIN(non_unique), GROUP_CONCAT(column_name ORDER BY seq_in_index)
+            FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = %s
+            GROUP BY index_name
+        """, (table,))
+        wanted = ",".join(columns).lower()
+        for _, non_unique, indexed in cursor.fetchall():
+            if unique:
+                if not non_unique and indexed.lower() == wanted:
+                    return
+            elif indexed.lower() == wanted or indexed.lower().startswith(wanted + ","):
+                return
+        cursor.execute("CREATE %sINDEX %s ON %s (%s)" % (
+            "UNIQUE " if unique else "", name, table, ", ".join(columns)
+        ))
+    return step
+
+
+def drop_index(name, table):
+    def step(cursor):
+        cursor.execute("""
+            SELECT 1 FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+            LIMIT 1
+        """, (table, name))
+        if cursor.fetchone():
+            cursor.execute("DROP INDEX %s ON %s" % (name, table))
+    return step
+
+
+def no_duplicates(table, column):
+    # Stops the migration with the values to fix by hand, rather than let
+    # CREATE UNIQUE INDEX fail on the first one.
+    def step(cursor):
+        cursor.execute("SELECT %s FROM %s GROUP BY %s HAVING COUNT(*) > 1 LIMIT 20" % (column, table, column))
+        duplicates = [row[0] for row in cursor.fetchall()]
+        if duplicates:
+            raise RuntimeError("%s.%s has duplicates, merge or rename them first: %s" % (
+                table, column, ", ".join(map(str, duplicates))))
+    return step
+
+
+def add_column(table, column, definition):
+    def step(cursor):
+        cursor.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        """, (table, column))
+        if cursor.fetchone():
+            return
+        cursor.execute("ALTER TABLE %s ADD COLUMN %s %s" % (table, column, definition))
+    return step
+
+
+MIGRATIONS = [
+    (1, "core tables", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            email VARCHAR(255) NOT NULL,
+            password VARCHAR(255) NOT NULL,
+            UNIQUE KEY uq_users_email (email)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS owners (
+            id INT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(100) NULL,
+            email VARCHAR(255) NOT NULL,
+            password VARCHAR(255) NOT NULL,
+            UNIQUE KEY uq_owners_email (email)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS products (
+            id INT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            image_url VARCHAR(1024) NOT NULL,
+            price DECIMAL(10, 2) NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS cart (
+            id INT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            user_id INT UNSIGNED NOT NULL,
+            pickle_name VARCHAR(255) NOT NULL,
+            quantity INT UNSIGNED NOT NULL,
+            cost DECIMAL(10, 2) NOT NULL,
+            KEY idx_cart_user (user_id, id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS orders (
+            id INT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            user_id INT UNSIGNED NOT NULL,
+            pickles VARCHAR(255) NOT NULL,
+            quantity INT UNSIGNED NOT NULL,
+            cost DECIMAL(10, 2) NOT NULL,
+            status VARCHAR(32) NOT NULL DEFAULT 'Ordered',
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            KEY idx_orders_user (user_id, id),
+            KEY idx_orders_status (status, id),
+            KEY idx_orders_created (created_at)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS catalog_meta (
+            id TINYINT UNSIGNED NOT NULL PRIMARY KEY,
+            version BIGINT UNSIGNED NOT NULL
+        )
+        """,
+        "INSERT IGNORE INTO catalog_meta (id, version) VALUES (1, 0)",
+    ]),
+    (2, "lookup indexes for hand-made schemas", [
+        add_index("idx_users_email", "users", ["email"]),
+        add_index("idx_owners_email", "owners", ["email"]),
+        add_index("idx_cart_user", "cart", ["user_id", "id"]),
+        add_index("idx_orders_user", "orders", ["user_id", "id"]),
+        add_index("idx_orders_status", "orders", ["status", "id"]),
+        add_index("idx_orders_created", "orders", ["created_at"]),
+    ]),
+    (3, "order events for the live owner dashboard", [
+        """
+        CREATE TABLE IF NOT EXISTS order_events (
+            id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            kind VARCHAR(32) NOT NULL,
+            payload VARCHAR(1024) NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            KEY idx_order_events_created (created_at)
+        )
+        """,
+    ]),
+    (4, "orders archive", [
+        """
+        CREATE TABLE IF NOT EXISTS orders_archive (
+            id INT UNSIGNED NOT NULL PRIMARY KEY,
+            user_id INT UNSIGNED NOT NULL,
+            pickles VARCHAR(255) NOT NULL,
+            quantity INT UNSIGNED NOT NULL,
+            cost DECIMAL(10, 2) NOT NULL,
+            status VARCHAR(32) NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            KEY idx_orders_archive_user (user_id, id),
+            KEY idx_orders_archive_created (created_at)
+        )
+        """,
+        add_index("idx_orders_status_created", "orders", ["status", "created_at"]),
+    ]),
+    (5, "sales aggregates", [
+        """
+        CREATE TABLE IF NOT EXISTS sales_daily (
+            day DATE NOT NULL,
+            pickle VARCHAR(255) NOT NULL,
+            status VARCHAR(32) NOT NULL,
+            order_count INT NOT NULL DEFAULT 0,
+            quantity BIGINT NOT NULL DEFAULT 0,
+            revenue DECIMAL(14, 2) NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, pickle, status)
+        )
+        """,
+        # Backfill from the orders already there; sets, never adds, so
+        # running it again is harmless.
+        sales.REBUILD_SQL,
+    ]),
+    (6, "product stock", [
+        # NULL: not stock-tracked, so existing products keep selling until
+        # the owner sets a count.
+        add_column("products", "stock", "INT UNSIGNED NULL"),
+        add_index("idx_products_name", "products", ["name"]),
+    ]),
+    (7, "unique product names", [
+        # Carts, orders and stock all name a product by products.name.
+        no_duplicates("products", "name"),
+        add_index("uq_products_name", "products", ["name"], unique=True),
+        drop_index("idx_products_name", "products"),
+    ]),
+]
+
+
+def ensure_history(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT UNSIGNED NOT NULL PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def upgrade(conn, target=None):
+    cursor = conn.cursor()
+    applied = ensure_history(cursor)
+    for version, name, steps in MIGRATIONS:
+        if version in applied or (target is not None and version > target):
+            continue
+        print("Applying %d: %s" % (version, name))
+        for step in steps:
+            if callable(step):
+                step(cursor)
+            else:
+                cursor.execute(step)
+        cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+        conn.commit()
+    cursor.close()
+
+
+def status(conn):
+    cursor = conn.cursor()
+    applied = ensure_history(cursor)
+    cursor.close()
+    for version, name, _ in MIGRATIONS:
+        print("%s %3d  %s" % ("[x]" if version in applied else "[ ]", version, name))
+
+
+# ------------------- Query Plan Check -------------------
+#
+# The statements app.py runs, with representative parameters. Keep this list
+# in step with the routes. `full_scan` marks statements that read a whole
+# table on purpose (the result is cached or the endpoint is a full dump).
+
+CHECKED_QUERIES = [
+    # name, statement, params, full_scan
+    ("login", "SELECT * FROM users WHERE email = %s", ("someone@example.com",), False),
+    ("register", "SELECT * FROM users WHERE email = %s", ("someone@example.com",), False),
+    ("owner_login", "SELECT * FROM owners WHERE email = %s", ("owner@example.com",), False),
+    ("get_profile", "SELECT name, email FROM users WHERE id = %s", (1,), False),
+    ("update_profile", "SELECT password FROM users WHERE id = %s", (1,), False),
+    ("cart_load", cart_store.LOAD_SQL, (1,), False),
+    ("cart_remove", cart_store.DELETE_SQL % "%s, %s", (1, 1, 2), False),
+    ("cart_write", cart_store.WRITE_SQL % ", ".join([cart_store.WRITE_ROW] * 2),
+     (1, 1, "Mango Pickle", 1, 100, None, 1, "Lime Pickle", 1, 100), False),
+    ("checkout_lock", "SELECT MAX(id) FROM cart WHERE user_id = %s FOR UPDATE", (1,), False),
+    ("checkout_move", """
+        INSERT INTO orders (user_id, pickles, quantity, cost, status)
+        SELECT user_id, pickle_name, quantity, cost, 'Ordered'
+        FROM cart WHERE user_id = %s AND id <= %s ORDER BY id
+    """, (1, 1), False),
+    ("checkout_totals", """
+        SELECT pickle_name, COUNT(*), SUM(quantity), SUM(cost)
+        FROM cart WHERE user_id = %s AND id <= %s GROUP BY pickle_name
+    """, (1, 1), False),
+    ("checkout_clear", "DELETE FROM cart WHERE user_id = %s AND id <= %s", (1, 1), False),
+    ("catalog_version", "SELECT version FROM catalog_meta WHERE id = 1", (), False),
+    ("catalog_load", "SELECT id, name, image_url, price FROM products ORDER BY id", (), True),
+    ("stock_tracked", *inventory.tracked_query({"Lime Pickle": 1, "Mango Pickle": 2}), False),
+    ("stock_take", *inventory.take_query({"Lime Pickle": 1, "Mango Pickle": 2}), False),
+    ("stock_release", *inventory.release_query({"Lime Pickle": 1, "Mango Pickle": 2}), False),
+    ("update_stock", "UPDATE products SET stock = stock + %s WHERE id = %s AND stock IS NOT NULL AND stock >= %s", (1, 1, 0), False),
+    ("delete_product", "DELETE FROM products WHERE id = %s", (1,), False),
+    ("get_orders", "SELECT * FROM orders ORDER BY id DESC", (), True),
+    ("get_orders_page", """
+        SELECT o.*, u.name AS user_name FROM orders o LEFT JOIN users u ON u.id = o.user_id
+        WHERE o.id < %s ORDER BY o.id DESC LIMIT %s
+    """, (1000000, 51), False),
+    ("get_orders_page_status", """
+        SELECT o.*, u.name AS user_name FROM orders o LEFT JOIN users u ON u.id = o.user_id
+        WHERE o.status = %s ORDER BY o.id DESC LIMIT %s
+    """, ("Ordered", 51), False),
+    ("get_orders_page_user", """
+        SELECT o.*, u.name AS user_name FROM orders o LEFT JOIN users u ON u.id = o.user_id
+        WHERE o.user_id = %s ORDER BY o.id DESC LIMIT %s
+    """, (1, 51), False),
+    ("export_orders", order_export.build_query("orders")[0], (), True),
+    ("export_orders_dates", order_export.build_query("orders", "2024-01-01", "2024-02-01")[0],
+     ("2024-01-01", "2024-02-01"), False),
+    ("export_orders_status", order_export.build_query("orders", "2024-01-01", "2024-02-01", ["Delivered"])[0],
+     ("Delivered", "2024-01-01", "2024-02-01"), False),
+    ("get_user_orders", "SELECT * FROM orders WHERE user_id = %s ORDER BY id DESC", (1,), False),
+    ("get_user_orders_archived", """
+        SELECT o.id, o.user_id, o.pickles, o.quantity, o.cost, o.status, o.created_at
+        FROM orders_archive o WHERE o.user_id = %s ORDER BY id DESC
+    """, (1,), False),
+    ("archive_batch", """
+        SELECT id FROM orders WHERE status IN (%s, %s) AND created_at < %s ORDER BY id LIMIT %s FOR UPDATE
+    """, ("Delivered", "1", "2000-01-01", 1000), False),
+    ("cancel_order", """
+        SELECT user_id, DATE(created_at), pickles, status, quantity, cost
+        FROM orders WHERE id = %s FOR UPDATE
+    """, (1,), False),
+    ("order_day", "SELECT DATE(created_at) FROM orders WHERE id = %s", (1,), False),
+    ("update_order_status", "UPDATE orders SET status = %s WHERE id = %s", ("Shipped", 1), False),
+    ("update_order_status_bulk", """
+        UPDATE orders SET status = CASE id WHEN %s THEN %s WHEN %s THEN %s END WHERE id IN (%s, %s)
+    """, (1, "Shipped", 2, "Shipped", 1, 2), False),
+    ("get_users", "SELECT id, name FROM users", (), True),
+    ("order_events_poll", "SELECT id, kind, payload FROM order_events WHERE id > %s ORDER BY id LIMIT 500", (1,), False),
+    ("sales_report", """
+        SELECT pickle, SUM(order_count), SUM(quantity), SUM(revenue)
+        FROM sales_daily WHERE day >= %s AND day <= %s
+        GROUP BY pickle HAVING SUM(order_count) <> 0 ORDER BY SUM(revenue) DESC LIMIT %s
+    """, ("2024-01-01", "2024-01-30", 500), False),
+    ("order_events_prune", "DELETE FROM order_events WHERE created_at < NOW() - INTERVAL %s HOUR LIMIT 1000", (24,), False),
+]
+
+
+def check(conn):
+    cursor = conn.cursor(dictionary=True)
+    failures = 0
+    for name, statement, params, full_scan_ok in CHECKED_QUERIES:
+        cursor.execute("EXPLAIN " + statement, params)
+        plan = cursor.fetchall()
+        scans = [row["table"] for row in plan if row.get("type") == "ALL"]
+        if not scans:
+            verdict = "ok"
+        elif full_scan_ok:
+            verdict = "full scan (expected)"
+        else:
+            verdict = "FULL SCAN on " + ", ".join(scans)
+            failures += 1
+        print("%-24s %s" % (name, verdict))
+    cursor.close()
+    # EXPLAIN of INSERT/DELETE/UPDATE never writes, but leave nothing open.
+    conn.rollback()
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Database schema migrations")
+    sub = parser.add_subparsers(dest="command", required=True)
+    up = sub.add_parser("upgrade", help="apply pending migrations")
+    up.add_argument("--to", type=int, help="stop after this version")
+    sub.add_parser("status", help="show applied migrations")
+    sub.add_parser("check", help="EXPLAIN app queries and fail on full table scans")
+    args = parser.parse_args(argv)
+
+    conn = connect()
+    try:
+        if args.command == "upgrade":
+            upgrade(conn, args.to)
+        elif args.command == "status":
+            status(conn)
+        elif args.command == "check":
+            failures = check(conn)
+            if failures:
+                print("%d quer%s would scan a whole table" % (failures, "y" if failures == 1 else "ies"))
+                return 1
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+# ------------------- Order Events -------------------
+#
+# Write routes append a row to order_events inside their own transaction
+# (record()). Each worker process runs one OrderEventFeed poller thread that
+# reads new rows with a single indexed query and keeps the latest ones in a
+# ring buffer. Dashboards read from that buffer (SSE or long-poll), so any
+# number of open dashboards costs one poll query per process, not one DB
+# connection each.
+
+EVENT_KINDS = ("order-created", "status-changed", "cancelled")
+
+# An id gap may be a transaction that has not committed yet; wait this long
+# for it before treating it as a rollback and moving past it.
+GAP_WAIT_SECONDS = 2.0
+
+
+def record(cursor, kind, **payload):
+    cursor.execute(
+        "INSERT INTO order_events (kind, payload) VALUES (%s, %s)",
+        (kind, json.dumps(payload, default=str)),
+    )
+
+
+def record_many(cursor, kind, payloads):
+    # Same as record() for many events, in one multi-row INSERT.
+    if not payloads:
+        return
+    cursor.execute(
+        "INSERT INTO order_events (kind, payload) VALUES " + ", ".join(["(%s, %s)"] * len(payloads)),
+        [value for payload in payloads for value in (kind, json.dumps(payload, default=str))],
+    )
+
+
+class OrderEventFeed:
+    def __init__(self, get_connection, buffer_size=1000, poll_interval=1.0,
+                 retention_hours=24, prune_interval=600):
+        self._get_connection = get_connection
+        self.buffer_size = buffer_size
+        self.poll_interval = poll_interval
+        self.retention_hours = retention_hours
+        self.prune_interval = prune_interval
+
+        self._cond = threading.Condition()
+        self._poke = threading.Event()
+        self._events = deque()
+        self._last_id = None   # newest id delivered to the buffer
+        self._floor = None     # events with id <= floor are no longer kept
+        self._gap_seen = None
+        self._pruned = 0.0
+        self._pid = None
+
+    # ---- reader side ----
+
+    def start(self):
+        # One poller per process, started on first use (and again after fork).
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._events.clear()
+            self._last_id = self._floor = None
+        threading.Thread(target=self._run, name="order-event-poller", daemon=True).start()
+
+    def cursor(self):
+        # Where a new subscriber starts; waits briefly for the first poll.
+        self.start()
+        with self._cond:
+            self._cond.wait_for(lambda: self._last_id is not None, timeout=5)
+            return self._last_id or 0
+
+    def since(self, last_seen):
+        # Events after `last_seen`, or None when some of them are gone from
+        # the buffer and the client has to reload instead.
+        with self._cond:
+            if self._last_id is None:
+                return []
+            if last_seen < self._floor:
+                return None
+            return [event for event in self._events if event["id"] > last_seen]
+
+    def wait(self, last_seen, timeout):
+        self.start()
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._last_id is not None and self._last_id > last_seen, timeout=timeout
+            )
+        return self.since(last_seen)
+
+    def poke(self):
+        # A local write just committed: poll now instead of at the next tick.
+        self._poke.set()
+
+    # ---- poller ----
+
+    def _run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            try:
+                self._poll()
+            except Exception as e:
+                print("Error polling order events:", e)
+            self._poke.wait(self.poll_interval)
+            self._poke.clear()
+
+    def _poll(self):
+        conn = self._get_connection()
+        if not conn:
+            return
+        with conn:
+            cursor = conn.cursor(dictionary=True)
+            try:
+                if self._last_id is None:
+                    cursor.execute("SELECT COALESCE(MAX(id), 0) AS id FROM order_events")
+                    tail = cursor.fetchone()["id"]
+                    with self._cond:
+                        self._last_id = self._floor = tail
+                        self._cond.notify_all()
+                    return
+
+                cursor.execute(
+                    "SELECT id, kind, payload FROM order_events WHERE id > %s ORDER BY id LIMIT 500",
+                    (self._last_id,),
+                )
+                self._deliver(cursor.fetchall())
+
+                if time.monotonic() - self._pruned > self.prune_interval:
+                    self._pruned = time.monotonic()
+                    cursor.execute(
+                        "DELETE FROM order_events WHERE created_at < NOW() - INTERVAL %s HOUR LIMIT 1000",
+                        (self.retention_hours,),
+                    )
+                    conn.commit()
+            finally:
+                cursor.close()
+
+    def _deliver(self, rows):
+        # Keep ids in order: stop in front of a gap until it has had
+        # GAP_WAIT_SECONDS to fill in.
+        accepted = []
+        expected = self._last_id + 1
+        for row in rows:
+            if row["id"] != expected:
+                if self._gap_seen is None:
+                    self._gap_seen = time.monotonic()
+                if time.monotonic() - self._gap_seen < GAP_WAIT_SECONDS:
+                    break
+            self._gap_seen = None
+            accepted.append(row)
+            expected = row["id"] + 1
+        if not accepted:
+            return
+
+        with self._cond:
+            for row in accepted:
+                self._events.append({"id": row["id"], "kind": row["kind"], "data": json.loads(row["payload"])})
+            while len(self._events) > self.buffer_size:
+                self._floor = self._events.popleft()["id"]
+            self._last_id = accepted[-1]["id"]
+            self._cond.notify_all()
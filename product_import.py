@@ -0,0 +1,71 @@
+import csv
+import io
+import json
+from decimal import Decimal, InvalidOperation
+
+
+# ------------------- Product Import -------------------
+#
+# Parses a CSV (header: name,image_url,price) or JSON-lines upload straight
+# off the request stream, one row at a time, so a large catalog never has to
+# fit in memory. Bad rows are reported by line number and skipped.
+
+COLUMNS = ("name", "image_url", "price")
+MAX_REPORTED_ERRORS = 1000
+
+
+def iter_records(stream, content_type):
+    # Yields (line number, dict) pairs.
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if "json" in (content_type or ""):
+        for line_no, line in enumerate(text, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield line_no, None
+                continue
+            yield line_no, record if isinstance(record, dict) else None
+    else:
+        reader = csv.DictReader(text)
+        for record in reader:
+            yield reader.line_num, record
+
+
+def to_row(record):
+    # dict -> (name, image_url, price); raises ValueError with a reason.
+    if record is None:
+        raise ValueError("not a valid record")
+    name = str(record.get("name") or "").strip()
+    image_url = str(record.get("image_url") or "").strip()
+    if not name:
+        raise ValueError("name is required")
+    if not image_url:
+        raise ValueError("image_url is required")
+    try:
+        price = Decimal(str(record.get("price")).strip())
+    except InvalidOperation:
+        raise ValueError("price must be a number")
+    if not price.is_finite() or price <= 0:
+        raise ValueError("price must be positive")
+    return name, image_url, price
+
+
+def chunked_rows(records, size, report):
+    # Groups valid rows into lists of `size`; invalid ones go to `report`.
+    chunk = []
+    for line_no, record in records:
+        try:
+            chunk.append(to_row(record))
+        except ValueError as e:
+            report["rejected"] += 1
+            if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                report["errors"].append({"line": line_no, "error": str(e)})
+            continue
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
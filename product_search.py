@@ -0,0 +1,211 @@
+import bisect
+import heapq
+import re
+import threading
+from decimal import Decimal, InvalidOperation
+
+
+# ------------------- Product Search -------------------
+#
+# An in-process index over products.name and price:
+#   - every word of every name in a sorted list, for prefix lookups,
+#   - a trigram -> ids map, for substring lookups of 3+ characters,
+#   - (price, id) pairs in a sorted list, for price ranges.
+# sync() brings the index up to a catalog version by diffing ids against the
+# product list CatalogCache already holds, so a change touches only the
+# products that changed. /insert-product and /delete-product also call
+# add()/remove() so this process sees its own writes at once.
+
+_WORD = re.compile(r"\w+")
+
+# A sync that changes more products than this (or a tenth of the index)
+# rebuilds from scratch.
+REBUILD_THRESHOLD = 1000
+
+
+def normalize(text):
+    return " ".join(_WORD.findall(str(text).lower()))
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def to_price(value):
+    try:
+        price = Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError("price must be a number")
+    if not price.is_finite():
+        raise ValueError("price must be a number")
+    return price
+
+
+class ProductIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = None
+        self._docs = {}       # id -> (product, normalized name, price)
+        self._words = []      # sorted (word, id)
+        self._grams = {}      # trigram -> set of ids
+        self._prices = []     # sorted (price, id)
+
+    # ---- maintenance ----
+
+    def sync(self, version, products):
+        with self._lock:
+            if self.version == version:
+                return
+            current = {product["id"]: product for product in products}
+            gone = [i for i in self._docs if i not in current]
+            changed = [
+                product for product_id, product in current.items()
+                if product_id not in self._docs or self._docs[product_id][0] != product
+            ]
+            if len(gone) + len(changed) > max(REBUILD_THRESHOLD, len(self._docs) // 10):
+                # Sorting once beats many list insertions.
+                self._rebuild(products)
+            else:
+                for product_id in gone:
+                    self._remove(product_id)
+                for product in changed:
+                    if product["id"] in self._docs:
+                        self._remove(product["id"])
+                    self._add(product)
+            self.version = version
+
+    def add(self, product):
+        with self._lock:
+            if product["id"] in self._docs:
+                self._remove(product["id"])
+            self._add(product)
+
+    def remove(self, product_id):
+        with self._lock:
+            if product_id in self._docs:
+                self._remove(product_id)
+
+    def _rebuild(self, products):
+        self._docs, self._words, self._grams, self._prices = {}, [], {}, []
+        for product in products:
+            product_id = product["id"]
+            name = normalize(product["name"])
+            price = to_price(product["price"])
+            self._docs[product_id] = (product, name, price)
+            self._words.extend((word, product_id) for word in set(name.split()))
+            for gram in trigrams(name):
+                self._grams.setdefault(gram, set()).add(product_id)
+            self._prices.append((price, product_id))
+        self._words.sort()
+        self._prices.sort()
+
+    def _add(self, product):
+        product_id = product["id"]
+        name = normalize(product["name"])
+        price = to_price(product["price"])
+        self._docs[product_id] = (product, name, price)
+        for word in set(name.split()):
+            bisect.insort(self._words, (word, product_id))
+        for gram in trigrams(name):
+            self._grams.setdefault(gram, set()).add(product_id)
+        bisect.insort(self._prices, (price, product_id))
+
+    def _remove(self, product_id):
+        product, name, price = self._docs.pop(product_id)
+        for word in set(name.split()):
+            i = bisect.bisect_left(self._words, (word, product_id))
+            if i < len(self._words) and self._words[i] == (word, product_id):
+                del self._words[i]
+        for gram in trigrams(name):
+            ids = self._grams.get(gram)
+            if ids is not None:
+                ids.discard(product_id)
+                if not ids:
+                    del self._grams[gram]
+        i = bisect.bisect_left(self._prices, (price, product_id))
+        if i < len(self._prices) and self._prices[i] == (price, product_id):
+            del self._prices[i]
+
+    # ---- queries ----
+
+    def _name_matches(self, query):
+        # ids whose name contains `query` (or, under 3 characters, has a
+        # word starting with it).
+        if len(query) < 3:
+            ids = set()
+            i = bisect.bisect_left(self._words, (query,))
+            while i < len(self._words) and self._words[i][0].startswith(query):
+                ids.add(self._words[i][1])
+                i += 1
+            return ids
+        sets = sorted((self._grams.get(gram, set()) for gram in trigrams(query)), key=len)
+        ids = set(sets[0]).intersection(*sets[1:])
+        return {i for i in ids if query in self._docs[i][1]}
+
+    def _price_range(self, min_price, max_price):
+        lo = 0 if min_price is None else bisect.bisect_left(self._prices, (min_price,))
+        if max_price is None:
+            hi = len(self._prices)
+        else:
+            # (max_price, inf) sorts after every id at that price.
+            hi = bisect.bisect_right(self._prices, (max_price, float("inf")))
+        return self._prices[lo:hi]
+
+    def _rank(self, query, product_id):
+        # Lower is better: exact name, name prefix, word prefix, substring;
+        # then shorter names, then newer products.
+        name = self._docs[product_id][1]
+        if name == query:
+            kind = 0
+        elif name.startswith(query):
+            kind = 1
+        elif (" " + name).find(" " + query) >= 0:
+            kind = 2
+        else:
+            kind = 3
+        return kind, len(name), -product_id
+
+    SORTS = ("relevance", "price_asc", "price_desc")
+
+    def search(self, query="", min_price=None, max_price=None, sort="relevance", limit=20, offset=0):
+        # Returns (total matches, products for this page).
+        # Only the first offset + limit matches are ever sorted.
+        query = normalize(query)
+        wanted = offset + limit
+        with self._lock:
+            if query:
+                ids = self._name_matches(query)
+                if min_price is not None or max_price is not None:
+                    ids = [
+                        i for i in ids
+                        if (min_price is None or self._docs[i][2] >= min_price)
+                        and (max_price is None or self._docs[i][2] <= max_price)
+                    ]
+                if sort == "relevance":
+                    top = heapq.nsmallest(wanted, ids, key=lambda i: self._rank(query, i))
+                elif sort == "price_desc":
+                    top = heapq.nlargest(wanted, ids, key=lambda i: (self._docs[i][2], i))
+                else:
+                    top = heapq.nsmallest(wanted, ids, key=lambda i: (self._docs[i][2], i))
+                total = len(ids)
+            else:
+                in_range = self._price_range(min_price, max_price)
+                if sort == "relevance":
+                    top = heapq.nlargest(wanted, in_range, key=lambda pair: pair[1])  # newest first
+                elif sort == "price_desc":
+                    top = in_range[::-1][:wanted]
+                else:
+                    top = in_range[:wanted]
+                top = [product_id for _, product_id in top]
+                total = len(in_range)
+            page = [self._docs[i][0] for i in top[offset:]]
+        return total, page
+
+    def stats(self):
+        with self._lock:
+            return {
+                "version": self.version,
+                "products": len(self._docs),
+                "words": len(self._words),
+                "trigrams": len(self._grams),
+            }
@@ -0,0 +1,214 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+
+from metrics import Histogram
+
+
+# ------------------- Query Stats -------------------
+#
+# Every statement run through a pooled cursor is reduced to a fingerprint
+# (literals and placeholder lists collapsed, so "IN (%s, %s)" and
+# "IN (%s, %s, %s)" are one query) and counted in a per-fingerprint latency
+# histogram. A statement slower than `slow_threshold` is logged, and a
+# background thread runs EXPLAIN for it on its own connection, at most once
+# per fingerprint every `explain_interval` seconds, so the request that was
+# slow never waits for it. The same thread writes everything to `dump_path`
+# every `dump_interval` seconds when a path is set.
+
+QUERY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+EXPLAINABLE = ("select", "update", "delete", "insert", "replace")
+
+_FINGERPRINT_RULES = [
+    (re.compile(r"--[^\n]*|/\*.*?\*/", re.S), " "),
+    (re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\""), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"%s"), "?"),
+    (re.compile(r"\s+"), " "),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(?+)"),
+    (re.compile(r"(?:\(\?\+\)\s*,\s*)+\(\?\+\)"), "(?+)+"),
+    (re.compile(r"\bWHEN \? THEN \?(?: WHEN \? THEN \?)+"), "WHEN ? THEN ?+"),
+]
+
+
+def fingerprint(statement):
+    text = statement
+    for pattern, replacement in _FINGERPRINT_RULES:
+        text = pattern.sub(replacement, text)
+    return text.strip()
+
+
+def quantile(histogram, q, above):
+    # Upper bound of the bucket holding the q-th observation; `above` when
+    # it lies past the last bucket.
+    if not histogram.count:
+        return None
+    rank = q * histogram.count
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        if cumulative >= rank:
+            return bound
+    return above
+
+
+class QueryEntry:
+    def __init__(self, text):
+        self.text = text
+        self.histogram = Histogram(QUERY_BUCKETS)
+        self.max_seconds = 0.0
+        self.slow = 0
+        self.explain = None
+        self.explained_at = None
+
+    def as_dict(self):
+        histogram = self.histogram
+        return {
+            "query": self.text,
+            "calls": histogram.count,
+            "total_seconds": round(histogram.sum, 6),
+            "mean_seconds": round(histogram.sum / histogram.count, 6) if histogram.count else 0.0,
+            "max_seconds": round(self.max_seconds, 6),
+            "p50_seconds": quantile(histogram, 0.5, self.max_seconds),
+            "p95_seconds": quantile(histogram, 0.95, self.max_seconds),
+            "p99_seconds": quantile(histogram, 0.99, self.max_seconds),
+            "slow": self.slow,
+            "explain": self.explain,
+        }
+
+
+class QueryStats:
+    def __init__(self, get_connection, slow_threshold=0.5, explain_interval=300,
+                 dump_path=None, dump_interval=60, max_fingerprints=1000):
+        self._get_connection = get_connection
+        self.slow_threshold = slow_threshold
+        self.explain_interval = explain_interval
+        self.dump_path = dump_path
+        self.dump_interval = dump_interval
+        self.max_fingerprints = max_fingerprints
+
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._fingerprints = {}   # statement text -> fingerprint
+        self._explain_queue = deque(maxlen=100)
+        self._wake = threading.Event()
+        self._dumped = time.monotonic()
+        self._pid = None
+
+    # ---- recording ----
+
+    def record(self, statement, params, seconds):
+        # A pool statement_observer.
+        if not statement:
+            return
+        key = self._fingerprints.get(statement)
+        if key is None:
+            key = fingerprint(statement)
+            if len(self._fingerprints) < self.max_fingerprints * 4:
+                self._fingerprints[statement] = key
+        explain = False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                if len(self._entries) >= self.max_fingerprints:
+                    key = "(other)"
+                    entry = self._entries.get(key)
+                if entry is None:
+                    entry = self._entries[key] = QueryEntry(key)
+            entry.histogram.observe(seconds)
+            entry.max_seconds = max(entry.max_seconds, seconds)
+            if seconds >= self.slow_threshold:
+                entry.slow += 1
+                now = time.monotonic()
+                if entry.explained_at is None or now - entry.explained_at > self.explain_interval:
+                    entry.explained_at = now
+                    explain = True
+        if seconds >= self.slow_threshold:
+            print("Slow query (%.3fs): %s" % (seconds, key))
+            if explain and statement.lstrip().split(None, 1)[0].lower() in EXPLAINABLE:
+                self._explain_queue.append((key, statement, params))
+                self._start()
+                self._wake.set()
+
+    # ---- reading ----
+
+    def snapshot(self, sort="total_seconds", limit=None):
+        with self._lock:
+            rows = [entry.as_dict() for entry in self._entries.values()]
+        rows.sort(key=lambda row: row[sort], reverse=True)
+        return rows[:limit] if limit else rows
+
+    def totals(self):
+        with self._lock:
+            return {
+                "fingerprints": len(self._entries),
+                "calls": sum(entry.histogram.count for entry in self._entries.values()),
+                "slow": sum(entry.slow for entry in self._entries.values()),
+            }
+
+    def reset(self):
+        with self._lock:
+            self._entries = {}
+
+    # ---- background work ----
+
+    def _start(self):
+        # One worker thread per process, started on first use.
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name="query-stats", daemon=True).start()
+
+    def start(self):
+        if self.dump_path:
+            self._start()
+
+    def _run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            self._wake.wait(self.dump_interval if self.dump_path else None)
+            self._wake.clear()
+            while self._explain_queue:
+                self._explain(*self._explain_queue.popleft())
+            if self.dump_path and time.monotonic() - self._dumped >= self.dump_interval:
+                self._dumped = time.monotonic()
+                self.dump()
+
+    def _explain(self, key, statement, params):
+        conn = self._get_connection()
+        if not conn:
+            return
+        try:
+            with conn:
+                cursor = conn.raw.cursor(dictionary=True)
+                try:
+                    cursor.execute("EXPLAIN " + statement, params)
+                    plan = cursor.fetchall()
+                finally:
+                    cursor.close()
+        except Exception as e:
+            print("Error explaining query %s:" % key, e)
+            return
+        print("EXPLAIN for slow query %s:\n%s" % (key, "\n".join(json.dumps(row, default=str) for row in plan)))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.explain = plan
+
+    def dump(self):
+        # Written to a temporary file and renamed, so readers never see half
+        # a dump. Each process writes its own file.
+        path = "%s.%d" % (self.dump_path, os.getpid())
+        data = {"pid": os.getpid(), "time": time.time(), "queries": self.snapshot()}
+        try:
+            with open(path + ".tmp", "w") as f:
+                json.dump(data, f, default=str, indent=1)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print("Error writing query stats:", e)
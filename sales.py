@@ -0,0 +1,147 @@
+import argparse
+import sys
+from decimal import Decimal
+
+
+# ------------------- Sales Aggregates -------------------
+#
+#   python sales.py check       compare sales_daily with the orders tables
+#   python sales.py rebuild     recompute sales_daily from scratch
+#
+# sales_daily keeps one row per (day, pickle, status) with the number of
+# orders, the quantity and the revenue. The order write routes adjust it in
+# the same transaction as the order change (add()), so the owner's report is
+# a small indexed read however many orders there are. Archiving orders does
+# not touch it: archived orders are still sales.
+
+FRESH_SQL = """
+    SELECT DATE(created_at), pickles, status, COUNT(*), SUM(quantity), SUM(cost)
+    FROM (
+        SELECT created_at, pickles, status, quantity, cost FROM orders
+        UNION ALL
+        SELECT created_at, pickles, status, quantity, cost FROM orders_archive
+    ) o
+    GROUP BY DATE(created_at), pickles, status
+"""
+
+REBUILD_SQL = (
+    "INSERT INTO sales_daily (day, pickle, status, order_count, quantity, revenue)"
+    + FRESH_SQL
+    + "ON DUPLICATE KEY UPDATE order_count = VALUES(order_count),"
+      " quantity = VALUES(quantity), revenue = VALUES(revenue)"
+)
+
+REPORT_GROUPS = ("pickle", "day", "status")
+
+
+def status_key(status):
+    # Statuses are stored as text; the dashboard's true/false land as 1/0.
+    if isinstance(status, bool):
+        return str(int(status))
+    return str(status)
+
+
+def add(cursor, rows):
+    # rows: (day, pickle, status, orders, quantity, revenue) deltas, negative
+    # to take orders out. Merged per key and written with one upsert, in key
+    # order so concurrent writers lock the rows in the same order.
+    totals = {}
+    for day, pickle, status, orders, quantity, revenue in rows:
+        key = (day, pickle, status_key(status))
+        counts = totals.setdefault(key, [0, 0, Decimal(0)])
+        counts[0] += orders
+        counts[1] += int(quantity)
+        counts[2] += Decimal(str(revenue))
+    keys = sorted(key for key, counts in totals.items() if any(counts))
+    if not keys:
+        return
+    cursor.execute(
+        "INSERT INTO sales_daily (day, pickle, status, order_count, quantity, revenue) VALUES "
+        + ", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(keys))
+        + " ON DUPLICATE KEY UPDATE order_count = order_count + VALUES(order_count),"
+          " quantity = quantity + VALUES(quantity), revenue = revenue + VALUES(revenue)",
+        [value for key in keys for value in key + tuple(totals[key])],
+    )
+
+
+def order_day(cursor, order_id):
+    # The day an order was stamped with. Rows from one INSERT share it.
+    cursor.execute("SELECT DATE(created_at) FROM orders WHERE id = %s", (order_id,))
+    return cursor.fetchone()[0]
+
+
+def report(cursor, group, date_from, date_to, limit):
+    cursor.execute("""
+        SELECT %s AS %s, SUM(order_count) AS orders, SUM(quantity) AS quantity, SUM(revenue) AS revenue
+        FROM sales_daily
+        WHERE day >= %%s AND day <= %%s
+        GROUP BY %s
+        HAVING SUM(order_count) <> 0
+        ORDER BY %s
+        LIMIT %%s
+    """ % (group, group, group, "day" if group == "day" else "revenue DESC"), (date_from, date_to, limit))
+    return cursor.fetchall()
+
+
+def drift(conn):
+    # Keys whose stored counters differ from a fresh count of the orders.
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT day, pickle, status, order_count, quantity, revenue FROM sales_daily"
+        )
+        stored = {tuple(row[:3]): tuple(row[3:]) for row in cursor.fetchall()}
+        cursor.execute(FRESH_SQL)
+        fresh = {tuple(row[:3]): tuple(row[3:]) for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+    zero = (0, 0, 0)
+    return sorted(
+        (key, stored.get(key, zero), fresh.get(key, zero))
+        for key in set(stored) | set(fresh)
+        if tuple(stored.get(key, zero)) != tuple(fresh.get(key, zero))
+    )
+
+
+def rebuild(conn):
+    # Order writes wait while this runs: the DELETE locks every counter row
+    # and INSERT ... SELECT share-locks the orders it reads.
+    cursor = conn.cursor()
+    try:
+        conn.start_transaction()
+        cursor.execute("DELETE FROM sales_daily")
+        cursor.execute(REBUILD_SQL)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def main(argv=None):
+    from migrations import connect
+
+    parser = argparse.ArgumentParser(description="Sales aggregate maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("check", help="report counters that differ from the orders tables")
+    sub.add_parser("rebuild", help="recompute all counters from the orders tables")
+    args = parser.parse_args(argv)
+
+    conn = connect()
+    try:
+        if args.command == "check":
+            rows = drift(conn)
+            for key, stored, fresh in rows:
+                print("%s %s %s: stored %s, actual %s" % (key + (stored, fresh)))
+            print("%d counter%s out of step" % (len(rows), "" if len(rows) == 1 else "s"))
+            return 1 if rows else 0
+        rebuild(conn)
+        print("sales_daily rebuilt")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
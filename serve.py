@@ -0,0 +1,80 @@
+import multiprocessing
+import os
+import sys
+
+from dotenv import load_dotenv
+from gunicorn.app.base import BaseApplication
+
+
+# ------------------- Production Server -------------------
+#
+#   python serve.py
+#
+# Runs the app under gunicorn: WEB_WORKERS processes with WEB_THREADS
+# threads each. The app is imported once in the master (preload) and the
+# workers are forked from it; each one resets its connection pools and warms
+# up (app.warm_up) before it accepts a request.
+#
+#   kill -HUP <master>    restart workers gracefully (same code)
+#   kill -USR2 <master>   start a new master with the new code, then
+#                         kill -QUIT the old one once it is up
+#
+# With preload, HUP forks the new workers from the already imported app, so
+# a code deploy needs the USR2 upgrade (or a full restart).
+
+
+def options():
+    load_dotenv()
+    workers = int(os.getenv("WEB_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+    return {
+        "bind": os.getenv("WEB_BIND", "0.0.0.0:%s" % os.getenv("PORT", "5050")),
+        "workers": workers,
+        "worker_class": "gthread",
+        "threads": int(os.getenv("WEB_THREADS", "8")),
+        "preload_app": True,
+        "timeout": int(os.getenv("WEB_TIMEOUT", "30")),
+        "graceful_timeout": int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30")),
+        "keepalive": int(os.getenv("WEB_KEEPALIVE", "5")),
+        "max_requests": int(os.getenv("WEB_MAX_REQUESTS", "0")),
+        "max_requests_jitter": int(os.getenv("WEB_MAX_REQUESTS_JITTER", "0")),
+        "accesslog": os.getenv("WEB_ACCESS_LOG") or None,
+        "errorlog": "-",
+        "post_fork": post_fork,
+        "post_worker_init": post_worker_init,
+    }
+
+
+def post_fork(server, worker):
+    import app
+    app.reset_after_fork()
+
+
+def post_worker_init(worker):
+    # Runs in the worker after the app is loaded, before it accepts.
+    import app
+    seconds = app.warm_up()
+    worker.log.info("Worker %s warmed up in %.2fs", worker.pid, seconds)
+
+
+class Server(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if value is not None:
+                self.cfg.set(key, value)
+
+    def load(self):
+        from app import app
+        return app
+
+
+def main():
+    Server(options()).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
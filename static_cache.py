@@ -0,0 +1,109 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+import time
+
+from flask import abort, request
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+
+# ------------------- Static Page Cache -------------------
+#
+# The HTML pages are read once, compressed once (gzip, and brotli when the
+# package is installed) and kept in memory. Each request only picks the best
+# encoding the client accepts and hands the ready bytes to the WSGI server
+# without copying them. Strong ETags make revisits a bodiless 304. Files are
+# re-read when their mtime changes, checked at most every `check_interval`.
+
+MIN_COMPRESS_SIZE = 512
+
+
+class StaticAsset:
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.stat(path).st_mtime
+        with open(path, "rb") as f:
+            body = f.read()
+        self.mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if self.mimetype.startswith("text/"):
+            self.mimetype += "; charset=utf-8"
+        digest = hashlib.sha256(body).hexdigest()[:20]
+
+        # encoding -> (bytes, etag); identity is always present.
+        self.variants = {"identity": (body, digest)}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            self.variants["gzip"] = (gzip.compress(body, 9, mtime=0), digest + "-gz")
+            if brotli is not None:
+                self.variants["br"] = (brotli.compress(body), digest + "-br")
+
+    def pick(self, accept_encoding):
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and accept_encoding[encoding]:
+                return encoding
+        return "identity"
+
+
+class StaticCache:
+    def __init__(self, root, names, max_age=0, check_interval=2.0):
+        self.root = root
+        self.names = set(names)
+        self.max_age = max_age
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._assets = {}
+        self._checked = {}
+
+    def load_all(self):
+        for name in self.names:
+            self.get(name)
+        return len(self._assets)
+
+    def get(self, name):
+        if name not in self.names:
+            return None
+        now = time.monotonic()
+        asset = self._assets.get(name)
+        if asset is not None and now - self._checked.get(name, 0) < self.check_interval:
+            return asset
+
+        path = os.path.join(self.root, name)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return None
+        if asset is None or asset.mtime != mtime:
+            asset = StaticAsset(path)
+            with self._lock:
+                self._assets[name] = asset
+        self._checked[name] = now
+        return asset
+
+    def response(self, name, response_class):
+        asset = self.get(name)
+        if asset is None:
+            abort(404)
+
+        encoding = asset.pick(request.accept_encodings)
+        body, etag = asset.variants[encoding]
+        if etag in request.if_none_match:
+            response = response_class(status=304)
+        else:
+            # direct_passthrough: the bytes go to the server as they are.
+            response = response_class([body], mimetype=asset.mimetype, direct_passthrough=True)
+            response.content_length = len(body)
+            if encoding != "identity":
+                response.content_encoding = encoding
+        response.set_etag(etag)
+        response.vary.add("Accept-Encoding")
+        if self.max_age:
+            response.cache_control.public = True
+            response.cache_control.max_age = self.max_age
+        else:
+            response.cache_control.no_cache = True
+        return response
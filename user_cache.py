@@ -0,0 +1,117 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# ------------------- User Cache -------------------
+#
+# Read-through cache for per-user reads (profile, order history), bounded to
+# `max_users` users in LRU order, each value kept at most `ttl` seconds.
+# Write routes call invalidate(user_id) after they commit.
+#
+# Every process has its own cache, so invalidate() only reaches the process
+# that handled the write. For the user's own writes the request also stamps
+# the session (see app.py), and get() ignores values loaded before that
+# stamp, so the next page load misses in every process. Owner status updates
+# cannot stamp the buyer's session: other processes catch up within `ttl`.
+# Values are stamped with the time their load *started*, so a write that
+# commits while a load is running always wins: the load's result is not
+# stored.
+
+# How long an invalidation is remembered for loads still running.
+INVALIDATION_MEMORY = 60.0
+
+MISS = object()
+
+
+class UserCacheEntry:
+    def __init__(self):
+        self.values = {}   # kind -> (loaded_at wall time, expires monotonic, value)
+
+
+class UserCache:
+    def __init__(self, max_users=10000, ttl=30.0):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # user_id -> UserCacheEntry, oldest first
+        self._invalidated = {}          # user_id -> time.time() of the last invalidate()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "invalidations": 0, "evictions": 0}
+
+    def get(self, user_id, kind, load, newer_than=None):
+        # The cached value, or load() stored and returned. `newer_than` is a
+        # time.time() before which cached values count as stale.
+        value = self.peek(user_id, kind, newer_than)
+        if value is MISS:
+            loaded_at = time.time()
+            value = load()
+            self.put(user_id, kind, value, loaded_at)
+        return value
+
+    def peek(self, user_id, kind, newer_than=None):
+        # The cached value or MISS. With put(), for callers whose load()
+        # cannot be a plain function call (asgi_app.py).
+        if not self.max_users:
+            return MISS
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            cached = entry.values.get(kind) if entry is not None else None
+            if cached is not None:
+                loaded_at, expires, value = cached
+                if now < expires and (newer_than is None or loaded_at >= newer_than):
+                    self._entries.move_to_end(user_id)
+                    self._stats["hits"] += 1
+                    return value
+                del entry.values[kind]
+                self._stats["expired"] += 1
+            self._stats["misses"] += 1
+        return MISS
+
+    def put(self, user_id, kind, value, loaded_at):
+        # loaded_at: time.time() from before the load started.
+        if not self.max_users:
+            return
+        with self._lock:
+            if self._invalidated.get(user_id, 0) >= loaded_at:
+                return
+            entry = self._entries.get(user_id)
+            if entry is None:
+                entry = self._entries[user_id] = UserCacheEntry()
+                while len(self._entries) > self.max_users:
+                    self._entries.popitem(last=False)
+                    self._stats["evictions"] += 1
+            else:
+                self._entries.move_to_end(user_id)
+            # A newer load that finished first is kept.
+            current = entry.values.get(kind)
+            if current is None or current[0] <= loaded_at:
+                entry.values[kind] = (loaded_at, time.monotonic() + self.ttl, value)
+
+    def invalidate(self, *user_ids):
+        if not self.max_users:
+            return
+        now = time.time()
+        with self._lock:
+            for user_id in user_ids:
+                self._invalidated[user_id] = now
+                if self._entries.pop(user_id, None) is not None:
+                    self._stats["invalidations"] += 1
+            if len(self._invalidated) > self.max_users:
+                self._invalidated = {
+                    user_id: at for user_id, at in self._invalidated.items() if now - at < INVALIDATION_MEMORY
+                }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._invalidated.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["users"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["max_users"] = self.max_users
+        return stats